@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" Benchmark of the pivot engines: ipit_functions.cross_tab vs ipit_pivot.
+
+Builds synthetic report rows shaped like the "All Projects" PEU and PHU reports
+and times both engines on them. Run:
+    python ipit_benchmark.py [report rows] [weeks, up to 52]
+"""
+
+import sys
+import random
+import timeit
+
+from ipit_functions import cross_tab
+from ipit_functions import gen_yw_list
+from ipit_pivot import pivot
+
+USAGES = ['Shared', 'Exclusive', 'Upgrade', 'Restart', 'Update', 'Reserved']
+
+
+def gen_peu_rows(n_rows, yw_list):
+    """ Rows like gen_peu_report(contain_id=True): 8 head columns, X, usage name. """
+    rows = []
+    for i in range(n_rows):
+        head = ('TM {0}'.format(i % 40), i % 40, 'node{0}'.format(i % 30),
+            'host{0}'.format(i), i, 'Project {0}'.format(i % 200), i % 200, '')
+        for yw in yw_list:
+            rows.append(head + (yw, random.choice(USAGES)))
+    return rows
+
+
+def gen_phu_rows(n_rows, yw_list):
+    """ Rows like gen_phu_report(contain_id=True): 9 head columns, X, hours. """
+    rows = []
+    for i in range(n_rows):
+        head = ('Dept {0}'.format(i % 10), 'Employee {0}'.format(i), i,
+            'Project {0}'.format(i % 200), i % 200, 'Tester', 'Internal', '', 'Assigned')
+        for yw in yw_list:
+            rows.append(head + (yw, float(random.randint(0, 40))))
+    return rows
+
+
+def bench(name, rows, yw_list, unique_len, repeat=7):
+    """ Time both engines on rows, check they agree and print the result. """
+    assert cross_tab(rows, yw_list, unique_len) == pivot(rows, yw_list, unique_len).to_rows()
+    t_old = min(timeit.repeat(lambda: cross_tab(rows, yw_list, unique_len),
+        number=1, repeat=repeat))
+    t_new = min(timeit.repeat(lambda: pivot(rows, yw_list, unique_len),
+        number=1, repeat=repeat))
+    t_rows = min(timeit.repeat(lambda: pivot(rows, yw_list, unique_len).to_rows(),
+        number=1, repeat=repeat))
+    print '{0}: {1} records'.format(name, len(rows))
+    print '    cross_tab        {0:8.1f} ms'.format(t_old * 1000)
+    print '    pivot            {0:8.1f} ms  ({1:.1f}x)'.format(t_new * 1000, t_old / t_new)
+    print '    pivot + to_rows  {0:8.1f} ms  ({1:.1f}x)'.format(t_rows * 1000, t_old / t_rows)
+
+
+if __name__ == '__main__':
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_weeks = int(sys.argv[2]) if len(sys.argv) > 2 else 52
+    yw_list = gen_yw_list(2016, 1, 2016, min(n_weeks, 52))
+    random.seed(0)
+    bench('PEU', gen_peu_rows(n_rows, yw_list), yw_list, 7)
+    bench('PHU', gen_phu_rows(n_rows, yw_list), yw_list, 8)
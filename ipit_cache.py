@@ -0,0 +1,395 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" Report result cache for IPIT.
+
+gen_peu_report, gen_phu_report and gen_request_report are pure functions of
+their rep string and the DB content. Their results are kept in an LRU cache,
+keyed on (report function, rep, contain_id, other options) and stamped with
+the data version they were built on.
+
+The data version is a counter in table DataVersions. track_writes() hooks the
+session maker, so every commit which wrote something (ORM flush or bulk
+query update/delete) bumps the counter in the same transaction. The counter
+lives in the DB, so a write in one server process invalidates the cache of
+every process. Core statements run with session.execute() don't pass the ORM
+hooks; call bump_data_version() next to them.
+
+The dropdown lists (departments, roles, ...) come from small tables which
+change a few times a month. ReferenceCache keeps them per process. Each of
+these tables has its own DataVersions counter, named after the table and
+bumped by track_writes() too, so a list is read again only when its table
+changed, in any process.
+
+NameIndex maps display names (hostnames, employee, project and usage names)
+to ids the same way: per lookup function, an LRU index stamped with the
+DataVersions counters of its tables. A rename or delete in one of them drops
+the index of that lookup.
+
+In a Flask request the counters of all VERSIONED_TABLES are read in one query
+on the first lookup and kept on flask.g, next to the request session (see
+ipit_session.py), so a page with ten dropdowns reads them once. A write in
+the request bumps the counters and drops the memo; writes by other processes
+are seen from the next request on.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+from itertools import chain
+
+from flask import g
+from flask import has_request_context
+from sqlalchemy import event
+
+from database_setup import DataVersions
+
+# Name of the DataVersions counter of the report cache.
+REPORTS = 'reports'
+
+# Writes to these tables don't change any report.
+UNTRACKED_TABLES = set(['DataVersions', 'ReportJobs'])
+
+# Dropdown list function name -> tables it reads. Each table has a DataVersions counter.
+REFERENCE_LISTS = {
+    'gen_department_list': ['Departments'],
+    'gen_role_list': ['Roles'],
+    'gen_domain_list': ['Domains'],
+    'gen_priority_list': ['Priorities'],
+    'gen_impact_list': ['Impact'],
+    'gen_status_list': ['Status'],
+    'gen_usages_list': ['ElementUsages'],
+    'gen_node_list': ['Nodes'],
+    'gen_applicant_list': ['Applicants'],
+    'gen_manager_list': ['Managers'],
+    }
+REFERENCE_TABLES = set(chain.from_iterable(REFERENCE_LISTS.values()))
+
+# Bulk name -> id lookup function name -> tables it reads. Each table has a DataVersions counter.
+NAME_LOOKUPS = {
+    'get_element_ids_by_name': ['Elements', 'Nodes'],
+    'get_employee_ids': ['Employees'],
+    'get_project_ids': ['Projects'],
+    'get_usage_ids': ['ElementUsages'],
+    }
+# Tables with their own DataVersions counter.
+VERSIONED_TABLES = REFERENCE_TABLES | set(chain.from_iterable(NAME_LOOKUPS.values()))
+
+
+def get_data_version(DBSession, name=REPORTS):
+    """ Return the current value of a DataVersions counter, 0 when it doesn't exist yet. """
+    session = DBSession()
+    version = (session.query(DataVersions.version)
+        .filter(DataVersions.name == name)
+        .scalar()
+        )
+    session.close()
+    return version or 0
+
+
+def get_data_versions(DBSession, names):
+    """ Return the values of DataVersions counters as a tuple in the order of names, in one query. """
+    session = DBSession()
+    versions = dict(session.query(DataVersions.name, DataVersions.version)
+        .filter(DataVersions.name.in_(names))
+        .all()
+        )
+    session.close()
+    return tuple(versions.get(x, 0) for x in names)
+
+
+def get_table_versions(DBSession, names):
+    """
+    Return the DataVersions counters of VERSIONED_TABLES names as a tuple in the
+    order of names. In a Flask request all VERSIONED_TABLES counters are read
+    once and kept on flask.g until the request ends or writes to one of them.
+    """
+    if not has_request_context():
+        return get_data_versions(DBSession, names)
+    versions = getattr(g, 'ipit_table_versions', None)
+    if versions is None:
+        tables = sorted(VERSIONED_TABLES)
+        versions = g.ipit_table_versions = dict(zip(tables, get_data_versions(DBSession, tables)))
+    return tuple(versions[x] for x in names)
+
+
+def bump_data_version(session, name=REPORTS):
+    """
+    Increase a DataVersions counter by one, in the transaction of session.
+    The row lock taken here serializes concurrent writers only until their commit.
+    """
+    table = DataVersions.__table__
+    updated = session.execute(table.update()
+        .where(table.c.name == name)
+        .values(version=table.c.version + 1)
+        ).rowcount
+    if not updated:
+        session.execute(table.insert().values(name=name, version=1))
+    if name in VERSIONED_TABLES and has_request_context():
+        g.pop('ipit_table_versions', None)  # Read them again, with this write.
+
+
+def _mark_written(session, tables):
+    session.info.setdefault('tables_written', set()).update(tables)
+
+
+def _after_flush(session, flush_context):
+    _mark_written(session, set(obj.__tablename__
+        for obj in chain(session.new, session.dirty, session.deleted)))
+
+
+def _after_bulk(context):
+    _mark_written(context.session, [context.primary_table.name])
+
+
+def _before_commit(session):
+    session.flush()  # before_commit runs ahead of the last flush of the commit.
+    tables = session.info.pop('tables_written', set())
+    if tables - UNTRACKED_TABLES:
+        bump_data_version(session)
+    for table in tables & VERSIONED_TABLES:
+        bump_data_version(session, table)
+
+
+def _after_rollback(session):
+    session.info.pop('tables_written', None)
+
+
+def track_writes(DBSession):
+    """
+    Bump the REPORTS data version on each commit of a session of DBSession
+    that wrote to the DB, and the version of each VERSIONED_TABLES table written.
+    Call once per session maker.
+    """
+    event.listen(DBSession, 'after_flush', _after_flush)
+    event.listen(DBSession, 'after_bulk_update', _after_bulk)
+    event.listen(DBSession, 'after_bulk_delete', _after_bulk)
+    event.listen(DBSession, 'before_commit', _before_commit)
+    event.listen(DBSession, 'after_rollback', _after_rollback)
+
+
+def result_size(result):
+    """ Approximate memory use in bytes of a report result (data, column_names, msg). """
+    data, column_names, msg = result
+    size = sys.getsizeof(data) + sys.getsizeof(column_names) + sys.getsizeof(msg)
+    size += sum(map(sys.getsizeof, column_names))
+    for row in data:
+        size += sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+    return size
+
+
+def copy_result(result):
+    """ Copy the lists of a report result, callers are free to modify theirs. """
+    data, column_names, msg = result
+    return [list(row) for row in data], list(column_names), msg
+
+
+def report_key(report, rep, contain_id=True, **kwargs):
+    """
+    Key of a report result in a ReportCache.
+    Example:
+        report_key(gen_peu_report, '/peu_0_2016_1_2016_10', conflicts_only=True)
+        ==> ('gen_peu_report', '/peu_0_2016_1_2016_10', True, ('conflicts_only', True))
+    """
+    return (report.__name__, rep, contain_id) + tuple(sorted(kwargs.items()))
+
+
+class ReportCache(object):
+    """
+    LRU cache of report results, capped on number of entries and on bytes.
+    All entries are built on the same data version; the first lookup which
+    sees a newer version drops them all. Pinned keys are never evicted for
+    room, only dropped with the data version.
+    Example:
+        cache = ReportCache()
+        data, column_names, msg = cache.get(DBSession, gen_peu_report, '/peu_0_2016_1_2016_10')
+    """
+    def __init__(self, max_entries=64, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (result, size), least recently used first.
+        self._lock = threading.Lock()
+        self._pinned = frozenset()
+        self.version = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _drop_all(self):
+        self.evictions += len(self._entries)
+        self._entries.clear()
+        self.bytes = 0
+
+    def get(self, DBSession, report, rep, contain_id=True, **kwargs):
+        """
+        Return report(DBSession, rep, contain_id=contain_id, **kwargs), from the
+        cache when it was built on the current data version.
+        Inputs:
+            report: gen_peu_report, gen_phu_report or gen_request_report.
+            kwargs: other options of report, like conflicts_only. They are part of the key.
+        Outputs:
+            (data, column_names, update_msg), a copy of the cached lists.
+        """
+        key = report_key(report, rep, contain_id, **kwargs)
+        version = get_data_version(DBSession)
+        with self._lock:
+            if version != self.version:
+                self._drop_all()
+                self.version = version
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry  # Most recently used.
+                self.hits += 1
+                return copy_result(entry[0])
+            self.misses += 1
+
+        result = report(DBSession, rep, contain_id=contain_id, **kwargs)
+        size = result_size(result)
+        with self._lock:
+            # Don't keep a result if the data changed meanwhile, or if it is too big.
+            if version == self.version and key not in self._entries and size <= self.max_bytes:
+                self._entries[key] = (result, size)
+                self.bytes += size
+                while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                    lru_key = next((x for x in self._entries if x not in self._pinned), None)
+                    if lru_key is None:  # Only pinned entries left.
+                        break
+                    self.bytes -= self._entries.pop(lru_key)[1]
+                    self.evictions += 1
+        return copy_result(result)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def pin(self, keys):
+        """ Keep the entries of keys (see report_key()) out of the LRU eviction. Replaces the former pins. """
+        with self._lock:
+            self._pinned = frozenset(keys)
+
+    def clear(self):
+        """ Drop all entries. Statistics are kept. """
+        with self._lock:
+            self._drop_all()
+
+    def stats(self):
+        """ Return a dict of hit rate and memory use, for monitoring. """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                'pinned': len(self._pinned), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'data_version': self.version}
+
+
+class ReferenceCache(object):
+    """
+    Per process cache of the dropdown lists of REFERENCE_LISTS. A lookup checks
+    the DataVersions counters of the tables behind the list, see get_table_versions().
+    Example:
+        cache = ReferenceCache()
+        department_list = cache.get(DBSession, gen_department_list)
+        role_list = cache.get(DBSession, gen_role_list, contain_id=True)
+    """
+    def __init__(self):
+        self._entries = {}  # key -> (versions, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, DBSession, gen_list, *args, **kwargs):
+        """
+        Return gen_list(DBSession, *args, **kwargs), from the cache when its tables didn't change.
+        Outputs:
+            A copy of the cached list.
+        """
+        key = (gen_list.__name__, args, tuple(sorted(kwargs.items())))
+        versions = get_table_versions(DBSession, REFERENCE_LISTS[gen_list.__name__])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self.hits += 1
+                return list(entry[1])
+            self.misses += 1
+        result = gen_list(DBSession, *args, **kwargs)
+        with self._lock:
+            self._entries[key] = (versions, result)
+        return list(result)
+
+    def clear(self):
+        """ Drop all entries. """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Return a dict of the hits and misses, for monitoring. """
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class NameIndex(object):
+    """
+    Per process LRU index of names to ids, for the bulk lookups of NAME_LOOKUPS.
+    A lookup checks the DataVersions counters of its tables (see get_table_versions()),
+    and queries the names not in the index.
+    Example:
+        index = NameIndex()
+        element_ids = index.resolve(DBSession, get_element_ids_by_name, ['PCRF:GVTEPP3', 'PCRF:GVTEPP4'])
+        employee_id = index.get(DBSession, get_employee_ids, u'Paling Kees')
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries  # Per lookup function.
+        self._indexes = {}  # lookup name -> (versions, OrderedDict name -> id, least recently used first)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, DBSession, lookup, names):
+        """
+        Return lookup(DBSession, names): a dictionary name -> id, unknown names left out.
+        Only the names missing from the index are queried.
+        """
+        names = set(names)
+        if not names:
+            return {}
+        versions = get_table_versions(DBSession, NAME_LOOKUPS[lookup.__name__])
+        result = {}
+        with self._lock:
+            index = self._indexes.get(lookup.__name__)
+            if index is None or index[0] != versions:
+                index = self._indexes[lookup.__name__] = (versions, OrderedDict())
+            entries = index[1]
+            for name in names:
+                if name in entries:
+                    result[name] = entries[name] = entries.pop(name)  # Most recently used.
+            missing = names - set(result)
+            self.hits += len(result)
+            self.misses += len(missing)
+        if not missing:
+            return result
+
+        found = lookup(DBSession, missing)
+        result.update(found)
+        with self._lock:
+            # Don't keep ids if the tables changed meanwhile.
+            if self._indexes.get(lookup.__name__) is index:
+                entries.update(found)
+                while len(entries) > self.max_entries:
+                    entries.popitem(last=False)
+        return result
+
+    def get(self, DBSession, lookup, name):
+        """ Return the id of one name. Raises KeyError when it is unknown. """
+        return self.resolve(DBSession, lookup, [name])[name]
+
+    def clear(self):
+        """ Drop all entries. """
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self):
+        """ Return a dict of the hits and misses, for monitoring. """
+        with self._lock:
+            return {'entries': sum(len(x[1]) for x in self._indexes.values()),
+                'hits': self.hits, 'misses': self.misses}
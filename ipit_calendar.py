@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" Employee availability calendar for IPIT.
+
+The available hours of an employee in a week are Employees.hours_available,
+unless an EmployeeAvailabilities override (holiday, part-time period) covers
+that week. Overrides are sparse week ranges, so a time window is answered with
+one query for the base hours, one for the overlapping overrides and one array
+slice per override. Never a query per week.
+"""
+
+import numpy
+
+from sqlalchemy.sql import func
+
+from database_setup import Employees
+from database_setup import EmployeeAvailabilities
+from database_setup import ProjectHumanUsages
+from database_setup import week_ordinal
+from database_setup import ordinal_to_yw
+
+
+def window_ordinals(time_line):
+    """ Return the first and last week_ordinal of [start_year, start_week, end_year, end_week]. """
+    return week_ordinal(*time_line[:2]), week_ordinal(*time_line[2:])
+
+
+def get_availability(DBSession, employee_ids, time_line):
+    """
+    Available hours of employees over a time window.
+    Inputs:
+        DBSession: session maker
+        employee_ids: iterable of ints.
+        time_line: [start_year, start_week, end_year, end_week], assumed valid.
+    Outputs:
+        ids: sorted list of the employee ids found. Row i of hours belongs to ids[i].
+        hours: 2-D numpy float array, one row per employee and one column per week.
+               Employees without hours_available have 0 hours.
+    Example:
+        ids, hours = get_availability(DBSession, [25, 21], [2016, 10, 2016, 12])
+        ids ==> [21, 25]
+        hours ==> array([[40., 0., 40.], [32., 32., 32.]])  # 21 on holiday in week 11.
+    """
+    first, last = window_ordinals(time_line)
+    employee_ids = set(employee_ids)
+    if not employee_ids:
+        return [], numpy.zeros((0, last - first + 1))
+
+    session = DBSession()
+    base = (session.query(Employees.employee_id, Employees.hours_available)
+        .filter(Employees.employee_id.in_(employee_ids))
+        .order_by(Employees.employee_id)
+        .all()
+        )
+    overrides = (session.query(EmployeeAvailabilities.employee_id,
+            EmployeeAvailabilities.start_week_ordinal,
+            EmployeeAvailabilities.end_week_ordinal, EmployeeAvailabilities.hours)
+        .filter(EmployeeAvailabilities.employee_id.in_(employee_ids))
+        .filter(EmployeeAvailabilities.start_week_ordinal <= last)
+        .filter(EmployeeAvailabilities.end_week_ordinal >= first)
+        .order_by(EmployeeAvailabilities.availability_id)
+        .all()
+        )
+    session.close()
+
+    ids = [x[0] for x in base]
+    base_hours = numpy.array([x[1] or 0 for x in base], dtype=float)
+    hours = numpy.repeat(base_hours.reshape(-1, 1), last - first + 1, axis=1)
+    rows = dict(zip(ids, range(len(ids))))
+    for emp_id, start, end, hour in overrides:  # Later overrides win.
+        hours[rows[emp_id], max(start, first) - first:min(end, last) - first + 1] = float(hour)
+    return ids, hours
+
+
+def get_free_hours(DBSession, employee_ids, time_line):
+    """
+    Available hours minus the hours already assigned in ProjectHumanUsages.
+    Inputs and outputs are the same as get_availability().
+    """
+    ids, hours = get_availability(DBSession, employee_ids, time_line)
+    if not ids:
+        return ids, hours
+    first, last = window_ordinals(time_line)
+    session = DBSession()
+    assigned = (session.query(ProjectHumanUsages.employee_id,
+            ProjectHumanUsages.week_ordinal, func.sum(ProjectHumanUsages.hours))
+        .filter(ProjectHumanUsages.employee_id.in_(ids))
+        .filter(ProjectHumanUsages.week_ordinal.between(first, last))
+        .group_by(ProjectHumanUsages.employee_id, ProjectHumanUsages.week_ordinal)
+        .all()
+        )
+    session.close()
+    if assigned:
+        rows = dict(zip(ids, range(len(ids))))
+        emp_ids, ordinals, assigned_hours = zip(*assigned)
+        hours[[rows[x] for x in emp_ids], numpy.array(ordinals) - first] -= numpy.array(
+            assigned_hours, dtype=float)
+    return ids, hours
+
+
+def add_availability(DBSession, employee_id, time_line, hours, note=None):
+    """
+    Set the available hours of an employee from start week to end week.
+    Inputs:
+        time_line: [start_year, start_week, end_year, end_week], assumed valid.
+        hours: float, hours per week. 0 for a holiday.
+    Outputs:
+        A string describing successful or not.
+    """
+    first, last = window_ordinals(time_line)
+    session = DBSession()
+    session.add(EmployeeAvailabilities(employee_id=employee_id, start_week_ordinal=first,
+        end_week_ordinal=last, hours=hours, note=note))
+    session.commit()
+    session.close()
+    return u"SUCCESSFUL: {0} hours per week set for {1}-{2} to {3}-{4}.".format(
+        hours, *time_line)
+
+
+def del_availability(DBSession, employee_id, availability_id):
+    """
+    Remove an override of an employee, who falls back to Employees.hours_available.
+    Outputs:
+        A string describing successful or not. Overrides of other employees are not removed.
+    """
+    session = DBSession()
+    qty = (session.query(EmployeeAvailabilities)
+        .filter(EmployeeAvailabilities.availability_id == availability_id)
+        .filter(EmployeeAvailabilities.employee_id == employee_id)
+        .delete()
+        )
+    session.commit()
+    session.close()
+    if not qty:
+        return u"FAILED: availability {0} doesn't exist for this employee.".format(availability_id)
+    return u"SUCCESSFUL: availability {0} removed.".format(availability_id)
+
+
+def gen_availability_list(DBSession, employee_id):
+    """
+    List the overrides of an employee, for display.
+    Outputs:
+        List of lists: [availability_id, (start_year, start_week), (end_year, end_week), hours, note]
+    """
+    session = DBSession()
+    q = (session.query(EmployeeAvailabilities.availability_id,
+            EmployeeAvailabilities.start_week_ordinal,
+            EmployeeAvailabilities.end_week_ordinal, EmployeeAvailabilities.hours,
+            EmployeeAvailabilities.note)
+        .filter(EmployeeAvailabilities.employee_id == employee_id)
+        .order_by(EmployeeAvailabilities.start_week_ordinal)
+        )
+    availabilities = [[x[0], ordinal_to_yw(x[1]), ordinal_to_yw(x[2]), float(x[3]), x[4]]
+        for x in q.all()]
+    session.close()
+    return availabilities
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" XLSX export of IPIT reports.
+
+The workbook runs in xlsxwriter's constant_memory mode: each row is flushed
+to a temp file as soon as the next row starts, so rows can come from a
+generator and memory stays flat whatever the row count. The price is that
+rows must be written in order, which all reports do.
+
+Formats are interned: one Format per style name and workbook, instead of
+one add_format() per written row.
+
+build_report() writes into a spooled buffer which is streamed to the HTTP
+response; nothing is stored on disk unless the export cache is enabled, see
+cached_report_path().
+"""
+
+import os
+import re
+import tempfile
+
+import xlsxwriter
+
+from ipit_functions import IMPORTANT_ELEMENT_USAGES
+from ipit_functions import gen_phu_report
+from ipit_functions import gen_request_report
+from ipit_functions import iter_peu_report
+from ipit_functions import gen_pwu_report
+from ipit_functions import get_project_name_byid
+
+# Exports up to this size stay in memory, bigger ones spill to a temp file.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Report letter of the download URL /p<ehcwr>u_... -> file name prefix.
+EXPORT_NAMES = {'e': 'ProjectElementUsages', 'h': 'ProjectHumanUsages',
+    'c': 'ProjectElementConflicts', 'w': 'WeeklyElementReport', 'r': 'ChangeRequests'}
+
+# Write a progress report every this many rows, see write_report().
+PROGRESS_STEP = 500
+
+# Style name -> xlsxwriter format properties.
+STYLES = {
+    'title': {'font_size': 15},
+    'header': {'bold': True},
+    'highlight': {'bg_color': '#FAB958'},
+    'negative': {'bg_color': '#FFC7CE', 'font_color': '#9C0006'},
+    'positive': {'bg_color': '#C6EFCE', 'font_color': '#006100'},
+    }
+
+
+class Formats(object):
+    """
+    Interned formats of a workbook.
+    Example:
+        formats = Formats(workbook)
+        worksheet.write(0, 0, 'IPIT', formats['title'])
+    """
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._formats = {}
+
+    def __getitem__(self, style):
+        if style not in self._formats:
+            self._formats[style] = self.workbook.add_format(STYLES[style])
+        return self._formats[style]
+
+
+def write_sheet(worksheet, formats, title, header, rows, group_column=None,
+        row_style=None, cell_styles=None, progress=None):
+    """
+    Write one report on a worksheet: title on row 0, header on row 1, then the rows.
+    Inputs:
+        formats: Formats of the workbook.
+        rows: iterable of lists, consumed once.
+        group_column: int. A blank row separates rows with a different value in this column.
+        row_style: function(row) -> style name of the whole row, or None.
+        cell_styles: function(row) -> dict {column: style name} overriding single cells.
+        progress: function(qty), called every PROGRESS_STEP rows with the rows written so far.
+    Outputs:
+        Number of rows written, not counting title, header and blank rows.
+    """
+    worksheet.write(0, 0, title, formats['title'])
+    worksheet.write_row(1, 0, header, formats['header'])
+    row_number = 1
+    qty = 0
+    previous = None
+    for row in rows:
+        row_number += 1
+        if group_column is not None:
+            if qty and row[group_column] != previous:
+                row_number += 1  # Blank row.
+            previous = row[group_column]
+        style = row_style(row) if row_style else None
+        if style:
+            worksheet.write_row(row_number, 0, row, formats[style])
+        else:
+            worksheet.write_row(row_number, 0, row)
+        if cell_styles:
+            for column, cell_style in cell_styles(row).items():
+                worksheet.write(row_number, column, row[column], formats[cell_style])
+        qty += 1
+        if progress and not qty % PROGRESS_STEP:
+            progress(qty)
+    return qty
+
+
+def write_report(filename, sheets, progress=None):
+    """
+    Write a constant-memory xlsx file with one worksheet per report.
+    Inputs:
+        filename: path, or a file-like object.
+        sheets: list of dicts with the arguments of write_sheet():
+                title, header, rows and optionally group_column, row_style, cell_styles.
+        progress: function(qty), called every PROGRESS_STEP rows with the rows written
+                  so far, on all worksheets together.
+    Outputs:
+        List with the number of rows written on each worksheet.
+    Example:
+        rows, header = iter_peu_report(DBSession, '/peu_0_2016_1_2016_52')
+        write_report('peu.xlsx', [{'title': 'ProjectElementUsages', 'header': header,
+            'rows': rows}])
+    """
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    formats = Formats(workbook)
+    qty = []
+    try:
+        for sheet in sheets:
+            done = sum(qty)
+            sheet_progress = progress and (lambda x: progress(done + x))
+            qty.append(write_sheet(workbook.add_worksheet(), formats, progress=sheet_progress,
+                **sheet))
+        return qty
+    finally:
+        workbook.close()
+
+
+def build_report(sheets):
+    """
+    Write the reports of write_report() into a spooled buffer.
+    Outputs:
+        A file object positioned at the start of the xlsx content. Closing it frees
+        the memory or removes the temp file.
+    """
+    xlsx = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    write_report(xlsx, sheets)
+    xlsx.seek(0)
+    return xlsx
+
+
+def cached_report_path(cache_dir, version, filename, gen_sheets):
+    """
+    On-disk export cache, keyed on the data version (see ipit_cache.py).
+    The file is written under a temp name and renamed, so concurrent downloads
+    never see a half written file. Files of older data versions are removed.
+    Inputs:
+        cache_dir: existing directory.
+        version: int, current data version.
+        filename: name of the export, like 'ProjectElementUsages_AllProject_2016_1_2016_52.xlsx'.
+        gen_sheets: function() -> sheets of write_report(). Only called on a cache miss.
+    Outputs:
+        Absolute path of the cached file.
+    """
+    prefix = '{0}_'.format(version)
+    path = os.path.abspath(os.path.join(cache_dir, prefix + filename))
+    if os.path.exists(path):
+        return path
+    for name in os.listdir(cache_dir):
+        if name.endswith('.xlsx') and not name.startswith(prefix):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:  # Removed by another worker, or still open on Windows.
+                pass
+    handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    with os.fdopen(handle, 'wb') as temp_file:
+        write_report(temp_file, gen_sheets())
+    try:
+        os.rename(temp_path, path)
+    except OSError:  # Windows doesn't replace, another worker was first.
+        os.remove(temp_path)
+    return path
+
+
+def export_name(DBSession, ehcwr, prj_id, str_y, str_w, end_y, end_w):
+    """
+    File name and titles of a report export.
+    Inputs:
+        ehcwr: report letter, see EXPORT_NAMES.
+        prj_id, str_y, str_w, end_y, end_w: strings, as in the download URL.
+    Outputs:
+        filename: like 'ProjectElementUsages_AllProject_2016_1_2016_52.xlsx'.
+        title: title of the first worksheet.
+        cr_title: title of the change request worksheet of report 'w', else None.
+    """
+    project_name = get_project_name_byid(DBSession, prj_id, zero_name='AllProject')
+    dates = [str_w, str_y, end_w, end_y]
+    title = "{0} / {1} ({2}-{3} - {4}-{5})".format(EXPORT_NAMES[ehcwr], project_name, *dates)
+    cr_title = None
+    if ehcwr == 'w':
+        cr_title = "{0} / {1} ({2}-{3} - {4}-{5})".format(EXPORT_NAMES['r'], project_name, *dates)
+    filename = '_'.join([EXPORT_NAMES[ehcwr], project_name, str_y, str_w, end_y, end_w])
+    filename = re.sub('[~!@#$%^&*()/?:;{}.<>=+]', '', filename) #remove signs from filename (they may cause a crash of the application)
+    filename = filename.replace(' ', '') #remove spaces in the filename
+    return filename + '.xlsx', title, cr_title
+
+
+def phu_difference_styles(row):
+    """ Colour the first week of a 'Difference' row of the phu export: red below 0, green above. """
+    if row[6] != 'Difference' or not row[7]:
+        return {}
+    return {7: 'negative' if row[7] < 0 else 'positive'}
+
+
+def important_usage_style(row):
+    """ Colour the rows of the pwu export with an important element usage. """
+    return 'highlight' if any(cel in IMPORTANT_ELEMENT_USAGES for cel in row) else None
+
+
+def call_report(DBSession, report, rep, **kwargs):
+    """ Default get_report of export_sheets(): run the report, no cache. """
+    return report(DBSession, rep, **kwargs)
+
+
+def export_sheets(DBSession, ehcwr, prj_id, str_y, str_w, end_y, end_w, get_report=call_report):
+    """
+    Query a report and describe its worksheets for write_report().
+    Inputs:
+        ehcwr, prj_id, str_y, str_w, end_y, end_w: as in export_name().
+        get_report: function(DBSession, report, rep, **kwargs) returning the result of
+                    report(DBSession, rep, **kwargs), like ReportCache.get.
+    Outputs:
+        List of worksheet dicts.
+    """
+    filename, title, cr_title = export_name(DBSession, ehcwr, prj_id, str_y, str_w, end_y, end_w)
+    rep = '_'.join([prj_id, str_y, str_w, end_y, end_w])
+    if ehcwr == 'e':
+        data, header = iter_peu_report(DBSession, '/peu_' + rep)  # Streamed, big reports stay out of memory.
+    elif ehcwr == 'c':
+        data, header = iter_peu_report(DBSession, '/peu_' + rep, conflicts_only=True)
+    elif ehcwr == 'h':
+        data, header, msg = get_report(DBSession, gen_phu_report, '/phu_' + rep, contain_id=False)
+    elif ehcwr == 'w':
+        data, header, msg = get_report(DBSession, gen_pwu_report, '/pwu_' + rep, contain_id=False)
+    else:
+        data, header, msg = get_report(DBSession, gen_request_report, '/pru_' + rep, contain_id=False)
+
+    sheet = {'title': title, 'header': header, 'rows': data}
+    if ehcwr == 'w':  # blank line between two different hostnames
+        sheet['group_column'] = 2
+        sheet['row_style'] = important_usage_style
+        # an extra worksheet with the change requests, with a blank line after a new description
+        cr_data, cr_header, msg = get_report(DBSession, gen_request_report, '/pru_' + rep,
+            contain_id=False)
+        return [sheet, {'title': cr_title, 'header': cr_header, 'rows': cr_data,
+            'group_column': 0}]
+    elif ehcwr == 'r':  # blank line between different descriptions
+        sheet['group_column'] = 0
+    elif ehcwr == 'h':
+        sheet['cell_styles'] = phu_difference_styles
+    return [sheet]
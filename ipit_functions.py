@@ -5,11 +5,27 @@
 import sys
 import re
 
+from collections import OrderedDict
 from datetime import date, datetime, timedelta
+from itertools import chain, count, imap, izip
+
+import numpy
 
 from sqlalchemy import distinct
 from sqlalchemy import or_
 from sqlalchemy import and_
+from sqlalchemy import case
+from sqlalchemy import bindparam
+from sqlalchemy import select
+from sqlalchemy import literal
+from sqlalchemy import literal_column
+from sqlalchemy import cast
+from sqlalchemy import extract
+from sqlalchemy import null
+from sqlalchemy import union_all
+from sqlalchemy import exists
+from sqlalchemy import Integer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.sql import label
 from sqlalchemy.sql import func
 
@@ -33,7 +49,22 @@ from database_setup import Impact
 from database_setup import Status
 from database_setup import Applicants
 from database_setup import ChangeRequestsElements
+from database_setup import ElementWeekFacts
+from database_setup import HumanWeekFacts
+from database_setup import week_ordinal
+from database_setup import ordinal_to_yw
+from database_setup import date_week_ordinal
+from database_setup import WEEK_ORDINAL_EPOCH
+from database_setup import CONFLICT_USAGES
 from popdata import float_or_none
+from ipit_pivot import pivot
+from ipit_calendar import get_availability
+from ipit_calendar import get_free_hours
+from ipit_cache import bump_data_version
+from ipit_facts import refresh_facts
+from ipit_upsert import bulk_insert
+from ipit_upsert import upsert
+from ipit_upsert import natural_key
 
 from sqlalchemy.exc import IntegrityError
 
@@ -44,14 +75,12 @@ VALID_NAME = re.compile(r'^\D{3,30}$')
 VALID_NAME_PRJ = re.compile(r'^[ \S]+$')  # space and any non-white characters.
 VALID_EMAIL = re.compile(r"^[\S]+@[\S]+\.[\S]+$")
 VALID_REG_NUM = re.compile(r'^[a-zA-Z0-9]{6}$')
-# This set is used for project element usage detection.
-# All usage in set means they can cause impact on other usages.
-CONFLICT_USAGES = set(['Cfg aanp. + Test Uitv.', 'Software update',
-    'software update + Testen', 'Switched off', 'Configuratie aanpassing'])
 # All usage in set means they are important for the weekly element report.
 IMPORTANT_ELEMENT_USAGES = set(['Cfg aanp. + Test Uitv.', 'Software update',
     'software update + Testen', 'Training', 'Configuratie aanpassing'])
 REQUEST_ELEMENTS = 4 # this number defines the amount of elements that can be added in a change request
+# Where reports pivot weeks into columns, see pivot_weeks(). 'sql' or 'python'.
+PIVOT_BACKEND = 'sql'
 
 class ErrorInvalidTime(Exception):
     "Local defined Exception for gen_yw_list()."
@@ -377,28 +406,24 @@ def gen_year_week_columns(start_year, start_week, end_year, end_week):
 
     return yw_columns, yw_columns_definition, x_series
 
-def gen_employee_hours(DBSession, name, time_line):
+def gen_employee_hours(DBSession, employee_ids, time_line):
     """
     A supporting function for add_rows_phu_report().
-    Given an employee, and a time period, generates a list of available hours.
+    Given employees, and a time period, generates lists of available hours.
+    Hours come from the availability calendar, so they can differ per week.
     Input:
         DBSession: session maker
-        name: string. The name of the Employee. Must be same as stroed in DB.
+        employee_ids: iterable of ints.
         time_line: list of 4 ints.
     Output:
-        employee_hours, list of strings.
+        employee_hours, dictionary. key: employee_id, value: list of floats, one per week.
     Example:
-        hours = gen_employee_hours("Dewei Zhai", 2016, 10, 2016, 12)
+        hours = gen_employee_hours(DBSession, [21, 25], [2016, 10, 2016, 12])
         hours
-        [40, 40, 40]
-    TODO: Change the logic to allow different hours in different weeks.
+        {21: [40.0, 0.0, 40.0], 25: [32.0, 32.0, 32.0]}
     """
-
-    session = DBSession()
-    hour = float(session.query(Employees.hours_available).filter(Employees.name
-        == name).first()[0])
-    session.close()
-    return [hour] * len(gen_yw_list(*time_line))
+    ids, hours = get_availability(DBSession, employee_ids, time_line)
+    return dict(zip(ids, hours.tolist()))
 
 def pre_4_cross_tab(raw):
     """
@@ -442,7 +467,8 @@ def cross_tab(in_data, x_series, unique_len=1):
     But in order to use that, we can't use ORM modle but via direct sql
     statement.
     This function aims to achieve the same function in python so that we
-    can stay in using ORM.
+    can stay in using ORM. The big reports pivot in Postgres instead, with
+    conditional aggregation, see pivot_weeks().
     Note:
     1 Col-1 is used to distinguish different Y.
     3 In output, each row is a list, not a tuple.
@@ -535,65 +561,18 @@ def allocation_plan(emp_id, form, DBSession):
     session = DBSession()
 
     # TODO: Distinguish the query whether it is one project of all.
-    if start_year == end_year:
-        raw_data = (
-            session.query(
-                Projects.name,
-                ProjectHumanUsages.year,
-                ProjectHumanUsages.week,
-                ProjectHumanUsages.hours
+    raw_data = (
+        query_time_window(session, ProjectHumanUsages,
+            [start_year, start_week, end_year, end_week],
+            Projects.name,
+            ProjectHumanUsages.year,
+            ProjectHumanUsages.week,
+            ProjectHumanUsages.hours
                          )
-            .filter(ProjectHumanUsages.employee_id == emp_id)
-            .filter(ProjectHumanUsages.year == start_year)
-            .filter(start_week <= ProjectHumanUsages.week)
-            .filter(ProjectHumanUsages.week <= end_week)
-            .filter(ProjectHumanUsages.project_id == Projects.project_id)
-            .all()
-                   )
-    else:
-        raw_data = []
-        for year in range(start_year, end_year + 1):
-            if year == start_year:  # start year
-                raw_data += (
-                session.query(
-                    Projects.name,
-                    ProjectHumanUsages.year,
-                    ProjectHumanUsages.week,
-                    ProjectHumanUsages.hours
-                             )
-                .filter(ProjectHumanUsages.employee_id == emp_id)
-                .filter(ProjectHumanUsages.year == year)
-                .filter(ProjectHumanUsages.week >= start_week)
-                .filter(ProjectHumanUsages.project_id == Projects.project_id)
-                .all()
-                       )
-            elif year < end_year:  # Middle years.
-                raw_data += (
-                session.query(
-                    Projects.name,
-                    ProjectHumanUsages.year,
-                    ProjectHumanUsages.week,
-                    ProjectHumanUsages.hours
-                             )
-                .filter(ProjectHumanUsages.employee_id == emp_id)
-                .filter(ProjectHumanUsages.year == year)
-                .filter(ProjectHumanUsages.project_id == Projects.project_id)
-                .all()
-                       )
-            else:
-                raw_data += (
-                session.query(
-                    Projects.name,
-                    ProjectHumanUsages.year,
-                    ProjectHumanUsages.week,
-                    ProjectHumanUsages.hours
-                             )
-                .filter(ProjectHumanUsages.employee_id == emp_id)
-                .filter(ProjectHumanUsages.year == year)
-                .filter(ProjectHumanUsages.week <= end_week)
-                .filter(ProjectHumanUsages.project_id == Projects.project_id)
-                .all()
-                       )
+        .filter(ProjectHumanUsages.employee_id == emp_id)
+        .filter(ProjectHumanUsages.project_id == Projects.project_id)
+        .all()
+               )
     session.close()
 
     raw_data = pre_4_cross_tab(raw_data)
@@ -636,69 +615,17 @@ def query_human_plan(DBSession, project_id, time_line):
     if not is_valid_time(*time_line):
         raise ErrorInvalidTime('query_human_plan received invalid time_line {0}'
             .format(time_line))
-    raw_data = []
-    session = DBSession()
-    if time_line[0] == time_line[2]:
-        raw_data = (session.query(Departments.department,
-                Roles.role, ProjectPlans.year, ProjectPlans.week, ProjectPlans.hours)
-            .filter(ProjectPlans.project_id == project_id)
-            .filter(ProjectPlans.department_id == Departments.department_id)
-            .filter(ProjectPlans.role_id == Roles.role_id)
-            .filter(ProjectPlans.year == time_line[0])
-            .filter(ProjectPlans.week >= time_line[1])
-            .filter(ProjectPlans.week <= time_line[3])
-            .all()
-            )
-    else:
-        for year in range(time_line[0], time_line[2] + 1):
-            if year == time_line[0]:
-                raw_data += (session.query(Departments.department,
-                    Roles.role, ProjectPlans.year, ProjectPlans.week, ProjectPlans.hours)
-                    .filter(ProjectPlans.project_id == project_id)
-                    .filter(ProjectPlans.department_id == Departments.department_id)
-                    .filter(ProjectPlans.role_id == Roles.role_id)
-                    .filter(ProjectPlans.year == year)
-                    .filter(ProjectPlans.week >= time_line[1])
-                    .all()
-                    )
-            elif year == time_line[2]:
-                raw_data += (session.query(Departments.department,
-                    Roles.role, ProjectPlans.year, ProjectPlans.week, ProjectPlans.hours)
-                    .filter(ProjectPlans.project_id == project_id)
-                    .filter(ProjectPlans.department_id == Departments.department_id)
-                    .filter(ProjectPlans.role_id == Roles.role_id)
-                    .filter(ProjectPlans.year == year)
-                    .filter(ProjectPlans.week <= time_line[3])
-                    .all()
-                    )
-            else:
-                raw_data += (session.query(Departments.department,
-                    Roles.role, ProjectPlans.year, ProjectPlans.week, ProjectPlans.hours)
-                    .filter(ProjectPlans.project_id == project_id)
-                    .filter(ProjectPlans.department_id == Departments.department_id)
-                    .filter(ProjectPlans.role_id == Roles.role_id)
-                    .filter(ProjectPlans.year == year)
-                    .all()
-                    )
-    session.close()
-    formatted_data = []
-    for a_row in raw_data:
-        temp = list(a_row[:2])  # [dept, role]
-        temp.append(tuple(a_row[2:4]))  # [dept, role, (year, week)]
-        try:
-            temp += map(float, a_row[4:])  # [dept, role, (year, week), hour1, hour2, ....]
-        except TypeError:
-            hours = []
-            for h in a_row[4:]:
-                try:
-                    hours.append(float(h))
-                except TypeError:
-                    hours.append(None)
-            temp += hours  # [dept, role, (year, week), hour1, hour2, ....]
-        formatted_data.append(temp)
+    session = DBSession()
+    q = (query_time_window(session, ProjectPlans, time_line)
+        .filter(ProjectPlans.project_id == project_id)
+        .filter(ProjectPlans.department_id == Departments.department_id)
+        .filter(ProjectPlans.role_id == Roles.role_id)
+        )
+    human_plan = pivot_weeks(q, ProjectPlans, time_line,
+        [Departments.department, Roles.role], ProjectPlans.hours, to_float=True)[0]
+    session.close()
 
     x_series = gen_yw_list(*time_line)  # [(year, week1), (year, week2), (year, week3)...]
-    human_plan = cross_tab(formatted_data, x_series, 2)
     column_names = ['Departments', 'Resource Type']
     column_names += map(lambda x: str(x[0]) + '-' + str(x[1]), x_series)
     return human_plan, column_names
@@ -951,6 +878,8 @@ def update_change_request(DBSession, req_id, form):
     Outputs:
         bool
     """
+    element_ids = get_element_ids_by_name(DBSession, [form['element_{}'.format(i)]
+        for i in range(REQUEST_ELEMENTS) if form.get('element_{}'.format(i))])
     session = DBSession()
     change_request = session.query(ChangeRequests).filter_by(change_request_id=req_id).first()
    
@@ -978,9 +907,7 @@ def update_change_request(DBSession, req_id, form):
         change_request_id=req_id).order_by(ChangeRequestsElements.request_element_id).all()
     for i in range(len(change_request_elements)):
         if form['element_{}'.format(i)]:
-            element_id = get_element_id(DBSession, form['element_{}'.format(i)])
-            change_request_elements[i].element_id = session.query(Elements.element_id).filter(
-              Elements.element_id == element_id).first()[0]
+            change_request_elements[i].element_id = element_ids[form['element_{}'.format(i)]]
         if form['note_{}'.format(i)]:
                 change_request_elements[i].note = form['note_{}'.format(i)]
         if form['start_date_{}'.format(i)]:
@@ -996,7 +923,7 @@ def update_change_request(DBSession, req_id, form):
     #then, update possible new request elements
     for i in range(len(change_request_elements), REQUEST_ELEMENTS):
         if form.get('element_{}'.format(i)):
-            new_el = new_request_element(DBSession, session, form, i)
+            new_el = new_request_element(DBSession, session, form, i, element_ids)
             session.add(new_el)
 
     try:
@@ -1080,13 +1007,8 @@ def gen_element_id_list(DBSession, data):
     for page /element_plan_edit
     returns a list with the elements_ids of the queried element plan 
     """
-    element_ids = []
-    for row in data:
-        element = row[1]+":"+ row[2] #node + hostname 
-        element_id = str(get_element_id(DBSession, element))
-        element_ids.append(element_id)
-    
-    return element_ids
+    element_ids = get_element_ids(DBSession, [(row[1], row[2]) for row in data])  # node, hostname
+    return [str(element_ids[(row[1], row[2])]) for row in data]
         
 def gen_priority_list(DBSession):
     """
@@ -1302,6 +1224,8 @@ def add_change_request(DBSession, form):
     if not form.get('description'):
         return "ERROR: Change Request Description can't be empty."
 
+    element_ids = get_element_ids_by_name(DBSession, [form['element_{}'.format(i)]
+        for i in range(REQUEST_ELEMENTS) if form.get('element_{}'.format(i))])
     session = DBSession()
     new_req = ChangeRequests(description= normalize_db_value(form['description']), status_id=3)
     if form.get('applicant'):
@@ -1318,7 +1242,7 @@ def add_change_request(DBSession, form):
 
     for i in range(REQUEST_ELEMENTS):
         if form.get('element_{}'.format(i)):
-            new_el = new_request_element(DBSession, session, form, i)
+            new_el = new_request_element(DBSession, session, form, i, element_ids)
             session.add(new_el)
     
     try:
@@ -1331,20 +1255,19 @@ def add_change_request(DBSession, form):
     session.close()
     return msg
 
-def new_request_element(DBSession, session, form, i):
+def new_request_element(DBSession, session, form, i, element_ids):
     """ 
     Description:
         Supporting function for page handler /new_change_request. 
         Makes one column with elements, date/time and note to send to the database
-        ChangeRequestsElements"""
+        ChangeRequestsElements
+        element_ids: the ids of the form elements, see get_element_ids_by_name()."""
     
     new_el = ChangeRequestsElements()
     new_el.change_request_id = session.query(ChangeRequests.change_request_id).filter(
                 ChangeRequests.description == normalize_db_value(form['description'])).first()[0]
     if form.get('element_{}'.format(i)):
-        element_id = get_element_id(DBSession, form['element_{}'.format(i)])
-        new_el.element_id = session.query(Elements.element_id).filter(
-              Elements.element_id == element_id).first()[0]
+        new_el.element_id = element_ids[form['element_{}'.format(i)]]
     if form['start_date_{}'.format(i)]:
         new_el.start_date = convert_date_format(form['start_date_{}'.format(i)])
                 
@@ -1879,7 +1802,8 @@ def query_element_usages(DBSession, elmt_id, form):
     time_line = map(int, [form['str_y'], form['str_w'], form['end_y'],
         form['end_w']])
 
-    query_obj = (session.query(Projects.name, ProjectElementUsages.year,
+    query_obj = (query_time_window(session, ProjectElementUsages, time_line,
+        Projects.name, ProjectElementUsages.year,
         ProjectElementUsages.week, ElementUsages.element_usage)
         .filter(ProjectElementUsages.element_id == elmt_id)
         .filter(ProjectElementUsages.project_id == Projects.project_id)
@@ -1887,29 +1811,7 @@ def query_element_usages(DBSession, elmt_id, form):
         )
     if form['project_name'] != "All Projects":
         query_obj = query_obj.filter(Projects.name == form['project_name'])
-
-    if time_line[0] == time_line[2]:
-        query_obj = (query_obj
-            .filter(ProjectElementUsages.year == time_line[0])
-            .filter(ProjectElementUsages.week >= time_line[1])
-            .filter(ProjectElementUsages.week <= time_line[3])
-            )
-        query_result = query_obj.all()
-    else:
-        query_result = []
-        for year in range(time_line[0], time_line[2] + 1):
-            if year == time_line[0]:
-                query_result += (query_obj
-                    .filter(ProjectElementUsages.year == year)
-                    .filter(ProjectElementUsages.week >= time_line[1])
-                    ).all()
-            elif year == time_line[2]:
-                query_result += (query_obj
-                    .filter(ProjectElementUsages.year == year)
-                    .filter(ProjectElementUsages.week <= time_line[3])
-                    ).all()
-            elif time_line[0] < year < time_line[2]:
-                query_result += query_obj.filter(ProjectElementUsages.year == year).all()
+    query_result = query_obj.all()
 
     session.close()
     data_before_pivot = [
@@ -2006,10 +1908,12 @@ def add_time_filter(in_query, table, time_line):
     """
     This function is used to update a SQLAlchemy query object by adding filter
     conditions about year and week.
+    The window is applied as one BETWEEN on the indexed column week_ordinal, so
+    also windows spanning multiple years are served by a single index range scan.
     Inputs:
         in_query: an object of type "sqlalchemy.orm.query.Query"
         table: class name of a ORM table.
-           1 This table must contain column year and week.
+           1 This table must contain column week_ordinal.
            2 It should be already a part of the in_query so that we can filter
            the result.
         time_line: a list to define start week and finish week.
@@ -2029,16 +1933,104 @@ def add_time_filter(in_query, table, time_line):
         ...
     """
     sy, sw, ey, ew = time_line  # s: start, e: end, y: year, w: week
-    if sy == ey:
-        return in_query.filter((table.year == sy) & 
-            (table.week >= sw) & (table.week <= ew)
-            )
-    if sy < ey:
-        return in_query.filter(
-            ((table.year == sy) & (table.week >= sw)) | 
-            ((table.year > sy) & (table.year < ey)) | 
-            ((table.year == ey) & (table.week <= ew))
-            )
+    return in_query.filter(
+        table.week_ordinal.between(week_ordinal(sy, sw), week_ordinal(ey, ew)))
+
+def pivot_weeks(query, table, time_line, keys, value, others=(), to_float=False,
+        backend=None):
+    """
+    Pivot a report query along the weeks of time_line: one row per report line,
+    one column per week.
+    Backends:
+        'sql': Postgres pivots, with one max(value) FILTER (WHERE week_ordinal = k)
+               column per week, named like gen_year_week_columns(). Only one row
+               per report line is transferred.
+        'python': one row per line-week is fetched and pivoted by ipit_pivot.
+    Inputs:
+        query: query object with all joins, filters (including the time window)
+               and order. Its columns are replaced here.
+        table: usage or fact table holding week_ordinal and value.
+        time_line: valid [start_year, start_week, end_year, end_week].
+        keys: list of columns, together identifying one report line.
+        value: the column pivoted into the week columns.
+        others: list of extra head columns, one value per line: the greatest value
+                over the records of the line, NULLs ignored (SQL max()), in both backends.
+        to_float: bool, convert the week values to float.
+        backend: 'sql' or 'python', by default PIVOT_BACKEND.
+    Outputs:
+        data: list of lists. keys + others + one value per week, None for empty weeks.
+        record_qty: int, number of line-week records pivoted.
+    """
+    backend = backend or PIVOT_BACKEND
+    keys, others = list(keys), list(others)
+    head_len = len(keys) + len(others)
+    convert = float_or_none if to_float else (lambda x: x)
+
+    if backend == 'sql':
+        rows = sql_pivot_query(query, table, time_line, keys, value, others).all()
+        data = [list(x[:head_len]) + map(convert, x[head_len:-1]) for x in rows]
+        return data, sum(x[-1] for x in rows)
+
+    # The fact tables have no year and week columns, only week_ordinal.
+    first, last = week_ordinal(*time_line[:2]), week_ordinal(*time_line[2:])
+    rows = query.with_entities(*(keys + others + [table.week_ordinal, value])).all()
+    greatest = {}  # key -> max() of others over the records of the line, like the sql backend.
+    for x in rows:
+        key = tuple(x[:len(keys)])
+        if key in greatest:  # None sorts below every value, so it is ignored like NULL.
+            greatest[key] = map(max, greatest[key], x[len(keys):head_len])
+        else:
+            greatest[key] = list(x[len(keys):head_len])
+    d = [tuple(x[:len(keys)]) + tuple(greatest[tuple(x[:len(keys)])]) + (x[-2], convert(x[-1]))
+        for x in rows]
+    return pivot(d, range(first, last + 1), len(keys)).to_rows(), len(d)
+
+def sql_pivot_query(query, table, time_line, keys, value, others=()):
+    """
+    The query of the 'sql' backend of pivot_weeks(): keys, max(x) of others,
+    one column per week and the count of line-week records.
+    """
+    keys, others = list(keys), list(others)
+    names = gen_year_week_columns(*time_line)[0].split(', ')
+    first = week_ordinal(*time_line[:2])
+    week_columns = [label(name, func.max(value).filter(table.week_ordinal == first + i))
+        for i, name in enumerate(names)]
+    return (query.with_entities(*(keys + [func.max(x) for x in others] + week_columns
+            + [func.count(value)]))
+        .group_by(*keys)
+        )
+
+def iter_pivot_weeks(query, table, time_line, keys, value, others=(), to_float=False,
+        batch=1000):
+    """
+    Generator version of pivot_weeks() with the 'sql' backend. The rows are
+    fetched in batches from a server side cursor and yielded one by one, so
+    memory doesn't grow with the size of the report.
+    Outputs:
+        Lists: keys + others + one value per week, None for empty weeks.
+    """
+    head_len = len(keys) + len(others)
+    convert = float_or_none if to_float else (lambda x: x)
+    for x in sql_pivot_query(query, table, time_line, keys, value, others).yield_per(batch):
+        yield list(x[:head_len]) + map(convert, x[head_len:-1])
+
+def query_time_window(session, table, time_line, *entities):
+    """
+    Shared query builder for reading a usage table over a time window.
+    The window is one range filter (see add_time_filter), so the whole window is
+    fetched in a single round trip, no matter how many years it spans.
+    Inputs:
+        session: an open SQLAlchemy session.
+        table: ORM table class containing the column week_ordinal.
+        time_line: [start_year, start_week, end_year, end_week], assumed valid.
+        entities: columns or classes to query, like for session.query().
+    Outputs:
+        A query object, ready for extra joins and filters.
+    Example:
+        q = query_time_window(session, ProjectPlans, [2015, 50, 2017, 3],
+            ProjectPlans.year, ProjectPlans.week, ProjectPlans.hours)
+    """
+    return add_time_filter(session.query(*entities), table, time_line)
 
 def gen_weekyear_list(startdate, enddate):
     """
@@ -2087,13 +2079,15 @@ def add_date_filter(in_query, time_line, ids = 3):
     Description:
         This function is made to convert a query with two date time objects, in multiple
         queries with a row for each week. 
+        Only change request elements overlapping the time window are fetched: the
+        overlap test runs in the DB, on index (start_date, end_date).
     Input:
         - query, with date displayed in datetime objects 
         - time_line
     Output:
         - rows with status per year and week. This means that one row could be converted
         to multiple rows, as in the example. 
-        - thereafter, the time filter is applied 
+        - weeks outside the time window are left out
     Example: 
     
         this row:
@@ -2111,22 +2105,18 @@ def add_date_filter(in_query, time_line, ids = 3):
         (u'Change Request Name', 5, u'Applicant name', u'112 Improvement Study', 56, u'Possible impact', u'1Me
         diation', u'zie MMD', u'In progress'593, u'', 2017, 13)  
     """
-    sy, sw, ey, ew = time_line  # s: start, e: end, y: year, w: week
-    
+    first, last = week_ordinal(*time_line[:2]), week_ordinal(*time_line[2:])
+    window_start = WEEK_ORDINAL_EPOCH + timedelta(weeks=first)  # Monday
+    window_end = WEEK_ORDINAL_EPOCH + timedelta(weeks=last, days=6)  # Sunday
+    in_query = in_query.filter(ChangeRequestsElements.start_date <= window_end
+        ).filter(ChangeRequestsElements.end_date >= window_start)
+
     data = []
     for row in in_query.all():
-        
-        for yearweek in gen_weekyear_list(row[12 + ids], row[13 + ids]):
-            
-            if sy == ey:
-                if yearweek[1] >= sw and yearweek[1] <= ew and yearweek[0] == sy:
-                    row = row[:12 + ids] + (yearweek[0], yearweek[1])
-                    data.append(row)
-                    
-            if sy < ey:
-                if (yearweek[0] == sy and yearweek[1] >= sw) or (yearweek[0] > sy and yearweek[0] < ey) or (yearweek[0] == ey and yearweek[1] <= ew):
-                    row = row[:12 + ids] + (yearweek[0], yearweek[1])
-                    data.append(row)
+        row_first = max(first, date_week_ordinal(row[12 + ids]))
+        row_last = min(last, date_week_ordinal(row[13 + ids]))
+        for ordinal in xrange(row_first, row_last + 1):
+            data.append(row[:12 + ids] + ordinal_to_yw(ordinal))
     return data
 
 def add_conflicted_projects(DBSession, old_data, ids = 3, report = False):
@@ -2136,9 +2126,9 @@ def add_conflicted_projects(DBSession, old_data, ids = 3, report = False):
     change request data: 
         (u'Upgrade PCRF SPC110', 2, u'Paling Kees', u'VoLTE', 7, u'Possible impact', u'PCRF', u'GVTEPP3', 13, datetime.date(2017, 4, 6),
         u'10:00', datetime.date(2017, 4, 6), u'12:00', u'', u'Accepted', 2017, 14)
-    data of conflicted project(s):
-        [[u'Groeneveld Martin', u'PCRF', u'GVTEPP3', u'Future of Mobile Step 5', u'Test uitvoering'],
-        [u'Alkemade Willem', u'PCRF', u'GVTEPP3', u'Converged Messaging', u'Test uitvoering']]
+    data of conflicted project(s), see get_conflicts_by_element_week():
+        [[u'Groeneveld Martin', u'Future of Mobile Step 5', u'Test uitvoering'],
+        [u'Alkemade Willem', u'Converged Messaging', u'Test uitvoering']]
     Results in:
         [(u'Upgrade PCRF SPC110', 2, u'Paling Kees', u'VoLTE', 7, u'Possible impact', u'PCRF', u'GVTEPP3', 13, datetime.date(2017, 4, 6),
         u'10:00', datetime.date(2017, 4, 6), u'12:00', u'', u'Accepted', u'Groeneveld Martin', u'Future of Mobile Step 5', u'Test uitvoering',
@@ -2148,13 +2138,17 @@ def add_conflicted_projects(DBSession, old_data, ids = 3, report = False):
         [u'request', 40, Applicant, u'000 TEST voorbeeld project IPIT netwerk', 29, u'No impact', u'1Mediation', u'Judith', 690, u'', datetime.date(2017, 4, 6),
         u'10:00', datetime.date(2017, 4, 6), u'12:00', u'', u'In progress', u'', u'', u'', 2017, 14]
     """
+    if report == True:
+        element_ids = get_element_ids(DBSession, set((row[4], row[5]) for row in old_data))
+        keys = [(element_ids.get((row[4], row[5])), row[12 + ids], row[13 + ids]) for row in old_data]
+    else:
+        keys = [(row[5 + ids], row[12 + ids], row[13 + ids]) for row in old_data]
+    # Conflicts are calculated per element per week, for all rows at once.
+    conflicts = get_conflicts_by_element_week(DBSession, keys)
+
     new_data = []
-    for old_row in old_data:
-        time_line = [old_row[12 + ids], old_row[13 + ids], old_row[12 + ids], old_row[13 + ids]] #conflicted elements are calculated per week
-        if report == True:
-            conflicted_projects = get_conflicted_elements(DBSession, time_line, [get_element_id(DBSession, "{0}:{1}".format(old_row[4], old_row[5]))])[0]
-        else:
-            conflicted_projects = get_conflicted_elements(DBSession, time_line, [old_row[5 + ids]])[0]
+    for old_row, key in zip(old_data, keys):
+        conflicted_projects = conflicts.get(key, [])
         if not conflicted_projects: # a row is added with only the change request information
             new_row = list(old_row)
             new_row.insert(12 + ids, u'')
@@ -2164,12 +2158,64 @@ def add_conflicted_projects(DBSession, old_data, ids = 3, report = False):
         for project in conflicted_projects:
             new_row = list(old_row)
             new_row.insert(12 + ids, project[0])
-            new_row.insert(13 + ids, project[3])
-            new_row.insert(14 + ids, project[4])
+            new_row.insert(13 + ids, project[1])
+            new_row.insert(14 + ids, project[2])
             new_data.append(tuple(new_row))
      
     return new_data
 
+def get_conflicts_by_element_week(DBSession, keys):
+    """
+    Description:
+        Set based version of get_conflicted_elements(), for add_conflicted_projects().
+        Finds the projects using each element in each week with one query.
+    Input:
+        DBSession: session maker
+        keys: list of (element_id, year, week). element_id None is skipped.
+    Output:
+        conflicts: dictionary,
+        key: (element_id, year, week), value: list of [test manager, project, usage].
+        Same projects as get_conflicted_elements() gives for that element and week.
+    """
+    keys = set(key for key in keys if key[0] is not None)
+    conflicts = {}
+    if not keys:
+        return conflicts
+    ordinals = [week_ordinal(y, w) for _, y, w in keys]
+
+    session = DBSession()
+    q = session.query(
+            ProjectElementUsages.element_id, ProjectElementUsages.year,
+            ProjectElementUsages.week, Employees.name, Projects.name,
+            ElementUsages.element_usage)
+    q = q.filter(
+        (Projects.test_manager_id == Employees.employee_id) &
+        (ProjectElementUsages.element_id == Elements.element_id) &
+        (ProjectElementUsages.element_usage_id == ElementUsages.element_usage_id) &
+        (ProjectElementUsages.project_id == Projects.project_id) & 
+        (Elements.node_id == Nodes.node_id) &
+        (Nodes.domain_id == Domains.domain_id ) )
+    q = q.filter(ProjectElementUsages.element_id.in_(set(key[0] for key in keys)))
+    q = q.filter(ProjectElementUsages.week_ordinal.between(min(ordinals), max(ordinals)))
+    q = q.order_by(Projects.name)
+    raw_data = q.all()
+    session.close()
+
+    # One entry per (test manager, project) in a week, like cross_tab() in get_conflicted_elements().
+    positions = {}
+    for element_id, year, week, test_manager, project, usage in raw_data:
+        key = (element_id, year, week)
+        if key not in keys:
+            continue
+        projects = conflicts.setdefault(key, [])
+        pos = positions.get(key + (test_manager, project))
+        if pos is None:
+            positions[key + (test_manager, project)] = len(projects)
+            projects.append([test_manager, project, usage])
+        else:
+            projects[pos][2] = usage
+    return conflicts
+
 def get_demand_hours(DBSession, time_line, role_id=3):
     """
     Description:
@@ -2201,7 +2247,29 @@ def get_demand_hours(DBSession, time_line, role_id=3):
 
     return target_data
 
-def gen_element_list(DBSession, full=False):
+def get_supply_hours(DBSession, employee_ids, time_line):
+    """
+    Description:
+        Used for "Person Project Matching", next to get_demand_hours().
+        Return the hours the given persons have left to match with, from the
+        availability calendar (see ipit_calendar.py).
+    Inputs:
+        employee_ids: list of ints.
+        time_line: a list to define start week and finish week. [start_year,
+        start_week, end_year, end_week].
+    Outputs:
+        supply_data: list of lists, ordered by name. Each list contains
+        [employee name, employee ID, free hours for wk1, hours2,...]
+    """
+    ids, free_hours = get_free_hours(DBSession, employee_ids, time_line)
+    session = DBSession()
+    names = dict(session.query(Employees.employee_id, Employees.name)
+        .filter(Employees.employee_id.in_(ids)).all()) if ids else {}
+    session.close()
+    return sorted([names[emp_id], emp_id] + hours
+        for emp_id, hours in zip(ids, free_hours.tolist()))
+
+def gen_element_list(DBSession, full=False, contain_id=False):
     """
     Description:
         Used to make a list of elements. The list contains node type and Element Hostname
@@ -2210,12 +2278,15 @@ def gen_element_list(DBSession, full=False):
     Input:
         DBSession, used to query IPIT DB
         full: controls whether this is for the /elements page which requires
+        contain_id: list of (element_id, "node:hostname") instead, for the typeahead search.
     Outputs:
         List of tuples, each tuple is (Element node + hostnames (strings)).
     """
     session = DBSession()
     # Query
-    if full:
+    if contain_id:
+        q = session.query(Elements.element_id, Nodes.node, Elements.hostname)
+    elif full:
         q = session.query(Elements.element_id, Domains.domain, Nodes.node,
             Elements.hostname, Elements.note)
     else:
@@ -2226,7 +2297,10 @@ def gen_element_list(DBSession, full=False):
         q = q.filter(Nodes.domain_id == Domains.domain_id)
     # Order
     q = q.order_by(Nodes.node, Elements.hostname)
-    result = q.all() if full else ['{0}:{1}'.format(x[0], x[1]) for x in q.all()]
+    if contain_id:
+        result = [(x[0], u'{0}:{1}'.format(x[1], x[2])) for x in q.all()]
+    else:
+        result = q.all() if full else ['{0}:{1}'.format(x[0], x[1]) for x in q.all()]
     session.close()
     return result
 
@@ -2338,6 +2412,24 @@ def is_valid_time_line(time_line):
     errors = [error_str_y, error_str_w, error_end_y, error_end_w]
     return valid_time_line, errors
 
+def is_valid_element(element_ids, elements):
+    """
+    Check the elements typed in the element fields, which are free text with a typeahead.
+    Input:
+        element_ids: the ids of the known elements among them, see get_element_ids_by_name().
+        elements: list of "node:hostname" strings. Empty strings are skipped.
+    Output:
+        valid: bool.
+        error: error string or empty string.
+    Example:
+        is_valid_element({u'PCRF:GVTEPP3': 13}, [u'PCRF:GVTEPP3', u'', u'PCRF:GVTE'])
+            ==> (False, u"Unknown element PCRF:GVTE, please choose one from the list.")
+    """
+    unknown = [x for x in elements if x and x not in element_ids]
+    if unknown:
+        return False, u"Unknown element {0}, please choose one from the list.".format(', '.join(unknown))
+    return True, ""
+
 def is_valid_date_time(start_dates, start_times, end_dates, end_times, elements):
     """Check whether the start date and time and the end date and time are valid
     on the pages of "change requests"
@@ -2503,36 +2595,31 @@ def update_project_human_plan(DBSession, time_line, hours, project_id, role_id,
     Output:
         result_msg: String. If successfully updated, provide message starts with "SUC" If failed starts with "ERR"
     """
-    # Query existing value.
+    # Upsert on the natural key (project, department, role, year, week), see ipit_upsert.py.
     session = DBSession()
-    q = session.query(ProjectPlans).filter(
-        (ProjectPlans.project_id == project_id) & 
-        (ProjectPlans.role_id == role_id) & 
-        (ProjectPlans.department_id == department_id))
-    q = add_time_filter(q, ProjectPlans, time_line)
-
-    # Remove existing value.
-    result = q.all()
-    for r in result:
-        session.delete(r)
-    result_msg = "SUCCESSFUL: {} records deleted".format(len(result))
-
-    if float(hours) > 0.00001:  # Hours 0 means deleting records.
-        kwargs = {}
-        kwargs['hours'] = float(hours)
-        kwargs['project_id'] = project_id
-        kwargs['department_id'] = department_id
-        kwargs['role_id'] = role_id
-        yw_list = gen_yw_list(*time_line)
-        for t in yw_list:
-            record = ProjectPlans(year=t[0], week=t[1], **kwargs)
-            session.add(record)
-        result_msg = "SUCCESSFUL: {} records updated.".format(len(yw_list))
+    table = ProjectPlans.__table__
     try:
+        if float(hours) > 0.00001:  # Hours 0 means deleting records.
+            yw_list = gen_yw_list(*time_line)
+            rows = [{'project_id': int(project_id), 'department_id': int(department_id),
+                'role_id': int(role_id), 'year': y, 'week': w, 'week_ordinal': week_ordinal(y, w),
+                'hours': float(hours), 'note': None} for y, w in yw_list]
+            written = upsert(session, table, rows, ['hours', 'note'])
+            result_msg = "SUCCESSFUL: {} records updated.".format(len(yw_list))
+        else:
+            sy, sw, ey, ew = time_line
+            written = session.execute(table.delete().where(
+                (table.c.project_id == project_id) & 
+                (table.c.role_id == role_id) & 
+                (table.c.department_id == department_id) &
+                table.c.week_ordinal.between(week_ordinal(sy, sw), week_ordinal(ey, ew)))).rowcount
+            result_msg = "SUCCESSFUL: {} records deleted".format(written)
+        if written:
+            bump_data_version(session)
         session.commit()
     except:
         session.rollback()
-        result_msg = "ERROR:" + sys.exc_info()[0]
+        result_msg = "ERROR:" + str(sys.exc_info()[0])
     session.close()
 
     return result_msg
@@ -2744,38 +2831,33 @@ def update_human_allocation(DBSession, time_line, hour, project_id, role_id, emp
     Output:
         update_msg: string. Tells it is SUCCESSFUL or ERROR. And how many records impacted.
     """
-    # Query existing value.
+    # Upsert on the natural key (project, employee, role, year, week), see ipit_upsert.py.
     session = DBSession()
-    q = session.query(ProjectHumanUsages).filter(
-        (ProjectHumanUsages.project_id == project_id) & 
-        (ProjectHumanUsages.role_id == role_id) & 
-        (ProjectHumanUsages.employee_id == employee_id))
+    table = ProjectHumanUsages.__table__
     valid_time_line = is_valid_time_line(time_line)[0]
-    q = add_time_filter(q, ProjectHumanUsages, valid_time_line)
-
-    # Remove existing value.
-    result = q.all()
-    for r in result:
-        session.delete(r)
-    result_msg = "SUCCESSFUL: {} records deleted".format(len(result))
-
-    if float(hour) > 0.00001:  # Hour 0 means deleting records.
-        kwargs = {}
-        kwargs['hours'] = float(hour)
-        kwargs['project_id'] = project_id
-        kwargs['employee_id'] = employee_id
-        kwargs['role_id'] = role_id
-        kwargs['note'] = note
-        yw_list = gen_yw_list(*valid_time_line)
-        for t in yw_list:
-            record = ProjectHumanUsages(year=t[0], week=t[1], **kwargs)
-            session.add(record)
-        result_msg = "SUCCESSFUL: {} records updated.".format(len(yw_list))
     try:
+        if float(hour) > 0.00001:  # Hour 0 means deleting records.
+            yw_list = gen_yw_list(*valid_time_line)
+            rows = [{'project_id': int(project_id), 'employee_id': int(employee_id),
+                'role_id': int(role_id), 'year': y, 'week': w, 'week_ordinal': week_ordinal(y, w),
+                'hours': float(hour), 'note': note} for y, w in yw_list]
+            written = upsert(session, table, rows, ['hours', 'note'])
+            result_msg = "SUCCESSFUL: {} records updated.".format(len(yw_list))
+        else:
+            sy, sw, ey, ew = valid_time_line
+            written = session.execute(table.delete().where(
+                (table.c.project_id == project_id) & 
+                (table.c.role_id == role_id) & 
+                (table.c.employee_id == employee_id) &
+                table.c.week_ordinal.between(week_ordinal(sy, sw), week_ordinal(ey, ew)))).rowcount
+            result_msg = "SUCCESSFUL: {} records deleted".format(written)
+        if written:
+            bump_data_version(session)
+            refresh_facts(session, HumanWeekFacts, {'employee_id': [int(employee_id)]})
         session.commit()
     except:
         session.rollback()
-        result_msg = "ERROR:" + sys.exc_info()[0]
+        result_msg = "ERROR:" + str(sys.exc_info()[0])
     session.close()
 
     return result_msg
@@ -2794,73 +2876,69 @@ def update_human_allocation_per_week(DBSession, hour_input, employee_id, project
         - update_msg: tells if SUCCESFULL of ERROR and how many values are changed.
         
     """
-    # Query existing values.
+    # Load the existing allocations of the employee in the window with one query,
+    # keyed on (project, week). Then diff them against the grid and apply the
+    # changes as bulk statements.
     session = DBSession()
-    if project[0] == 0:
-        project_id = Projects.project_id
-    else:
-        project_id = project[0]
-    q = session.query(ProjectHumanUsages).filter(
-                (ProjectHumanUsages.project_id == project_id) & 
+    q = session.query(ProjectHumanUsages.project_human_usage_id, ProjectHumanUsages.project_id,
+        ProjectHumanUsages.week_ordinal, ProjectHumanUsages.hours, ProjectHumanUsages.role_id,
+        ProjectHumanUsages.note).filter(
+                (ProjectHumanUsages.project_id == Projects.project_id) & 
                 (ProjectHumanUsages.role_id == Roles.role_id) & 
                 (ProjectHumanUsages.employee_id == employee_id))
-    
-    q = add_time_filter(q, ProjectHumanUsages, valid_time_line)
-    
+    if project[0] != 0:
+        q = q.filter(ProjectHumanUsages.project_id == project[0])
+    q = add_time_filter(q, ProjectHumanUsages, valid_time_line).order_by(Projects.name)
+
+    records = {}
+    prjs = OrderedDict()  # project_id -> its first record, projects in the order of the grid rows.
+    for r in q:
+        records.setdefault((r.project_id, r.week_ordinal), r)
+        prjs.setdefault(r.project_id, r)
+
     yw_list = gen_yw_list(*valid_time_line)
     hour_inputs = split_list(hour_input, len(yw_list)) # make array for every project
-    
-    if project[0] == 0: # more projects might be queried
-        q = q.order_by(Projects.name)
-        result = q.all()    
-        prjs = (r.project_id for r in result) # save id of projects
-        prjs = unique(prjs)
-    else:
-        result = q.all()    
-        prjs = [project[0]] #save id of one project
-    
-    n_prj = len(set([r.project_id for r in result])) # count amount of projects
-    
-    deleted = 0
-    updated = 0
-    added = 0
-    for p, pr in enumerate(prjs):
-        q_prj = q.filter(ProjectHumanUsages.project_id == pr)
+
+    deleted_ids = []
+    updates = []
+    new_rows = []
+    for p, (pr, first) in enumerate(prjs.items()):
         hours = hour_inputs[p]
-        prj_result = q_prj.all()
-        role_id = [project.role_id for project in prj_result]
-        role_id = role_id[0]
-        note = [project.note for project in prj_result]
-        note = note[0]
         for count, yw in enumerate(yw_list):
-            q_yw = q_prj.filter(ProjectHumanUsages.year == yw[0], ProjectHumanUsages.week == yw[1])
-            db_rec = q_yw.one_or_none()
+            db_rec = records.get((pr, week_ordinal(*yw)))
             if db_rec:
-                yw_result = q_yw.one()
                 if hour_is_zero(hours[count]): #delete record from database
-                    session.delete(yw_result)
-                    deleted += 1
-                else: # update record in database
-                    if yw_result.hours != float(hours[count]):
-                        yw_result.hours = hours[count]
-                        updated += 1
-            else:
-                if not hour_is_zero(hours[count]): # add record to database
-                    kwargs = {'hours': float(hours[count]),
-                              'project_id': pr,
-                              'employee_id': employee_id,
-                              'role_id': role_id,
-                              'note': note,
-                              'year': yw_list[count][0],
-                              'week': yw_list[count][1]
-                              }
-                    record = ProjectHumanUsages(**kwargs)
-                    session.add(record)
-                    added += 1
-    
+                    deleted_ids.append(db_rec.project_human_usage_id)
+                elif db_rec.hours != float(hours[count]): # update record in database
+                    updates.append({'b_id': db_rec.project_human_usage_id,
+                        'b_hours': float(hours[count])})
+            elif not hour_is_zero(hours[count]): # add record to database, role and note of the project
+                new_rows.append({'hours': float(hours[count]),
+                                 'project_id': pr,
+                                 'employee_id': employee_id,
+                                 'role_id': first.role_id,
+                                 'note': first.note,
+                                 'year': yw[0],
+                                 'week': yw[1],
+                                 'week_ordinal': week_ordinal(*yw)
+                                 })
+
+    # Core statements pass no ORM hooks, see update_element_plan().
+    table = ProjectHumanUsages.__table__
     try:
+        if deleted_ids:
+            session.execute(table.delete().where(table.c.project_human_usage_id.in_(deleted_ids)))
+        if updates:
+            session.execute(table.update()
+                .where(table.c.project_human_usage_id == bindparam('b_id'))
+                .values(hours=bindparam('b_hours')), updates)
+        bulk_insert(session, table, new_rows)
+        if deleted_ids or updates or new_rows:
+            bump_data_version(session)
+            refresh_facts(session, HumanWeekFacts, {'employee_id': [employee_id]})
         session.commit()
-        result_msg = "SUCCESSFUL: {0} record(s) added, {1} record(s) updated and {2} record(s) deleted.".format(added, updated, deleted)
+        result_msg = "SUCCESSFUL: {0} record(s) added, {1} record(s) updated and {2} record(s) deleted.".format(
+            len(new_rows), len(updates), len(deleted_ids))
     except:
         session.rollback()
         result_msg = "ERROR:" + str(sys.exc_info()[0])
@@ -2895,18 +2973,6 @@ def split_list(the_list, chunk_size):
         the_list = the_list[chunk_size:]
     return result_list
 
-def unique( list ):
-    """
-    supporting function for update_human_allocation_per_week
-    input: list
-    output: list with unique parts, where the order is preserved 
-    """ 
-    uniq = []
-    for i in list:
-        if i not in uniq:
-            uniq.append(i)
-    return uniq
-
 def gen_request_report(DBSession, rep, contain_id=True):
     """
     Inputs:
@@ -2986,7 +3052,43 @@ def gen_request_report(DBSession, rep, contain_id=True):
 
     return data, column_names, update_msg
 
-def gen_peu_report(DBSession, rep, contain_id=True):
+def get_conflict_usages(DBSession):
+    """
+    Return the set of element usages flagged as conflict usage in the DB.
+    """
+    session = DBSession()
+    usages = set(x[0] for x in session.query(ElementUsages.element_usage)
+        .filter(ElementUsages.conflict == True).all())
+    session.close()
+    return usages
+
+def conflicted_elements_query(session, time_line, prj_id=0):
+    """
+    Description:
+        Conflict detection in the DB. Groups ProjectElementUsages by (element_id, week)
+        and keeps the groups used by >= 2 projects, where at least one usage is flagged
+        ElementUsages.conflict. Same rule as filter_conflicts() with report_type 'pcu'.
+    Inputs:
+        session: an open session.
+        time_line: valid time line.
+        prj_id: int, 0 for all projects. Else only usages of this project account.
+    Outputs:
+        A subquery of the distinct element_ids having a conflict in the time line.
+    """
+    q = session.query(ProjectElementUsages.element_id).filter(
+        ProjectElementUsages.element_usage_id == ElementUsages.element_usage_id)
+    if prj_id > 0:
+        q = q.filter(ProjectElementUsages.project_id == prj_id)
+    q = add_time_filter(q, ProjectElementUsages, time_line)
+    q = (q.group_by(ProjectElementUsages.element_id, ProjectElementUsages.week_ordinal)
+        .having(func.count(distinct(ProjectElementUsages.project_id)) >= 2)
+        .having(func.sum(case([(ElementUsages.conflict == True, 1)], else_=0)) >= 1)
+        .distinct()
+        .correlate(None)  # Don't correlate to the report query, it uses the same tables.
+        )
+    return q.subquery()
+
+def gen_peu_report(DBSession, rep, contain_id=True, conflicts_only=False):
     """
     Inputs:
         DBSession: used to access IPIT DB.
@@ -2994,6 +3096,9 @@ def gen_peu_report(DBSession, rep, contain_id=True):
         It contains the filter information for this report.
         contain_id, bool val. default true.
         Controls whether in output data column 1,4,6, contains employee_id, element_id, project_id.
+        conflicts_only, bool val. default false.
+        When true, only the elements with conflicts are queried, see conflicted_elements_query().
+        This is the 'pcu' report.
         This function is called in two situantion. Number 1, by page to give online display. In this case
         , we need to contain_id so that we can make hyper links to the items. Number 2, called when user want to
         down load a file. In this case, we don't need to contain the ids.
@@ -3015,58 +3120,72 @@ def gen_peu_report(DBSession, rep, contain_id=True):
     time_line = map(int, rep[2:])
     valid_time_line = is_valid_time_line(time_line)[0]
 
-    # Make query
+    # Make query on the fact table, fetch data pivoted along time.
     session = DBSession()
+    q, keys = peu_report_query(session, prj_id, valid_time_line, contain_id, conflicts_only)
+    data, record_qty = pivot_weeks(q, ElementWeekFacts, valid_time_line, keys,
+        ElementWeekFacts.element_usage, others=[ElementWeekFacts.note])
+    update_msg = "SUCCESSFUL: {} records retrieved.".format(record_qty)
+    session.close()
+
+    return data, peu_column_names(valid_time_line), update_msg
+
+def peu_report_query(session, prj_id, valid_time_line, contain_id=True, conflicts_only=False):
+    """
+    The query of gen_peu_report() on ElementWeekFacts, before the pivot.
+    The names are already resolved in the fact table.
+    Outputs:
+        q: query with filters and order.
+        keys: list of the key columns of a report line.
+    """
+    F = ElementWeekFacts
     if contain_id:
-        q = session.query(
-            Employees.name, Employees.employee_id, Nodes.node, Elements.hostname,
-            Elements.element_id, Projects.name, Projects.project_id,
-            ProjectElementUsages.note, ProjectElementUsages.year,
-            ProjectElementUsages.week, ElementUsages.element_usage)
+        keys = [F.test_manager_name, F.test_manager_id, F.node, F.hostname, F.element_id,
+            F.project_name, F.project_id]
     else:
-        q = session.query(
-            Employees.name, Nodes.node, Elements.hostname,
-            Projects.name, ProjectElementUsages.note, ProjectElementUsages.year,
-            ProjectElementUsages.week, ElementUsages.element_usage)
-
-    # OUTER JOIN 13-Sep Bug fix: Adding this out Join statement. Because some project has no Test Manager ID.
-    q = q.select_from(Projects).outerjoin(Employees, Projects.test_manager_id == Employees.employee_id)
+        keys = [F.test_manager_name, F.node, F.hostname, F.project_name]
+    q = session.query(*keys)
 
-    # INNER JOIN
-    q = q.filter(
-        (ProjectElementUsages.element_usage_id == ElementUsages.element_usage_id) & 
-        (ProjectElementUsages.element_id == Elements.element_id) & 
-        (ProjectElementUsages.project_id == Projects.project_id) & 
-        (Elements.node_id == Nodes.node_id))
     # Filter
     if prj_id > 0:  # prj_id = 0 : No reports for all projects.
-        q = q.filter(ProjectElementUsages.project_id == prj_id)
-    q = add_time_filter(q, ProjectElementUsages, valid_time_line)
+        q = q.filter(F.project_id == prj_id)
+    q = add_time_filter(q, F, valid_time_line)
+    if conflicts_only:
+        conflicted = conflicted_elements_query(session, valid_time_line, prj_id)
+        q = q.filter(F.element_id.in_(conflicted))
 
     # Order
-    q = q.order_by(Nodes.node, Elements.hostname)
+    return q.order_by(F.node, F.hostname), keys
 
-    # Fetch raw data
-    if contain_id:
-        d = [x[:8] + ((x[8], x[9]), x[10]) for x in q.all()]
-    else:
-        d = [x[:5] + ((x[5], x[6]), x[7]) for x in q.all()]
-    update_msg = "SUCCESSFUL: {} records retrieved.".format(len(d))
-    session.close()
+def peu_column_names(valid_time_line):
+    """ Column names of the peu report, without the id columns. """
+    return (['Test Manager', 'Node', 'Hostname', 'Project', 'Note'] +
+        [" " + str(x[1]) + '-' + str(x[0]) for x in gen_yw_list(*valid_time_line)])  # Use Swaen's format.
 
-    # Pivote along time
-    yw_list = gen_yw_list(*valid_time_line)
-    if contain_id:
-        data = cross_tab(d, yw_list, 7)  # set to 8 - 1 because the note doesn't account.
-    else:
-        data = cross_tab(d, yw_list, 4)  # set to 8 - 1 because the note doesn't account.
+def iter_peu_report(DBSession, rep, contain_id=False, conflicts_only=False):
+    """
+    Streaming version of gen_peu_report(), for the xlsx export of big reports.
+    Inputs are the same as gen_peu_report().
+    Outputs:
+        rows: generator of the report lines. The session stays open until it is exhausted.
+        column_names: list of strings.
+    """
+    rep = rep[1:].split('_')
+    prj_id = int(rep[1])
+    valid_time_line = is_valid_time_line(map(int, rep[2:]))[0]
 
-    # Prepare
-    column_names = (['Test Manager', 'Node', 'Hostname', 'Project', 'Note'] + 
-        # gen_year_week_columns(*time_line)[0].split(', ')
-        [" " + str(x[1]) + '-' + str(x[0]) for x in yw_list])  # Use Swaen's format.
+    def gen_rows():
+        session = DBSession()
+        try:
+            q, keys = peu_report_query(session, prj_id, valid_time_line, contain_id,
+                conflicts_only)
+            for row in iter_pivot_weeks(q, ElementWeekFacts, valid_time_line, keys,
+                    ElementWeekFacts.element_usage, others=[ElementWeekFacts.note]):
+                yield row
+        finally:
+            session.close()
 
-    return data, column_names, update_msg
+    return gen_rows(), peu_column_names(valid_time_line)
 
 def gen_phu_report(DBSession, rep, contain_id=True, employee_id = None):
     """
@@ -3090,65 +3209,46 @@ def gen_phu_report(DBSession, rep, contain_id=True, employee_id = None):
     time_line = map(int, rep[2:])
     valid_time_line = is_valid_time_line(time_line)[0]
 
-    # Make query
+    # Make query on the fact table. The ids are always queried, add_rows_phu_report()
+    # needs employee_id.
+    F = HumanWeekFacts
     session = DBSession()
-    if contain_id:
-        q = session.query(
-                Departments.department, Employees.name, Employees.employee_id,
-                Projects.name, Projects.project_id, Roles.role, Employees.contract_type,
-                ProjectHumanUsages.note, ProjectHumanUsages.year, ProjectHumanUsages.week,
-                ProjectHumanUsages.hours)
-    else:
-        q = session.query(
-                Departments.department, Employees.name, Projects.name, Roles.role,
-                Employees.contract_type, ProjectHumanUsages.note, ProjectHumanUsages.year,
-                ProjectHumanUsages.week, ProjectHumanUsages.hours)
-
-    # JOINs
-    q = q.filter(
-            (Departments.department_id == Employees.department_id) & 
-            (Employees.employee_id == ProjectHumanUsages.employee_id) & 
-            (ProjectHumanUsages.project_id == Projects.project_id) & 
-            (ProjectHumanUsages.role_id == Roles.role_id))
+    keys = [F.department, F.employee_name, F.employee_id, F.project_name, F.project_id,
+        F.role, F.contract_type, F.note]
+    q = session.query(*keys)
 
     # Filters
     if prj_id:
-        q = q.filter(ProjectHumanUsages.project_id == prj_id)
+        q = q.filter(F.project_id == prj_id)
     if employee_id:
-        q = q.filter(ProjectHumanUsages.employee_id == employee_id)
-            
-    q = add_time_filter(q, ProjectHumanUsages, valid_time_line)
+        q = q.filter(F.employee_id == employee_id)
+    q = add_time_filter(q, F, valid_time_line)
 
     # Orders
-    q = q.order_by(Departments.department, Employees.name, Projects.name)
+    # employee_id keeps the rows of two employees with the same name apart, see add_rows_phu_report().
+    q = q.order_by(F.department, F.employee_name, F.employee_id, F.project_name)
 
-    # Get Data
-    d = q.all()
-    update_msg = "SUCCESSFUL: {} records retrieved.".format(len(d))
+    # Get Data, pivoted along time
+    data, record_qty = pivot_weeks(q, F, valid_time_line, keys, F.hours, to_float=True)
+    update_msg = "SUCCESSFUL: {} records retrieved.".format(record_qty)
     session.close()
 
     # Process Data
-    if contain_id:
-        data = [x[:8] + ('Assigned', (x[8], x[9]), float(x[10])) for x in d]  # Add one more column.
-    else:
-        data = [x[:6] + ('Assigned', (x[6], x[7]), float(x[8])) for x in d]
-
-    # Pivot
+    data = [x[:len(keys)] + ['Assigned'] + x[len(keys):] for x in data]  # Add one more column.
     yw_list = gen_yw_list(*valid_time_line)
-    if contain_id:
-        data = cross_tab(data, yw_list, 8)
-    else:
-        data = cross_tab(data, yw_list, 6)
+
     # Prepare
     column_names = (['Department', 'Employee', 'Project', 'Role', 'Personel Type',
      'Note', 'Type'] + [" " + str(x[1]) + '-' + str(x[0]) for x in yw_list])
 
     if prj_id == 0:  # These extra rows are only added when query on "All projects"
-        data = add_rows_phu_report(DBSession, data, time_line, contain_id=contain_id)
+        data = add_rows_phu_report(DBSession, data, time_line)
+    if not contain_id:  # Remove employee_id and project_id.
+        data = [x[:2] + x[3:4] + x[5:] for x in data]
 
     return data, column_names, update_msg
 
-def add_rows_phu_report(DBSession, data, time_line, contain_id=True):
+def add_rows_phu_report(DBSession, data, time_line):
     """
     Description:
         In page "/reports", we need to generate phu report. The direct query from SQL DB only contains
@@ -3157,15 +3257,10 @@ def add_rows_phu_report(DBSession, data, time_line, contain_id=True):
         Note: The input data must be ordered. All record from same person must be together.
     Input:
         DBSession: session maker
-        data: The query new_data, list of tuples
-        time_line: list of 4 ints.
-        contain_id: tells if the data contains employee_id and project_id.
-        When containing id:
+        data: The query new_data, list of lists, containing employee_id and project_id:
         # dept, name, employee_id, project, project_id, rold, contract_type, note, type, hour1, hour2, ...
-        [('Innovation Test Data', 'Daamen Camille', 21, '4G EPC UGW capaciteit extensie', 50, 'Tester', 'OP', 'OP', 'Assigned', 10.0, 10.0, 10.0)]
-        when not containing id:
-        # dept, name, project, rold, contract_type, note, hour1, hour2, ...
-        [('Innovation Test Data', 'Daamen Camille','4G EPC UGW capaciteit extensie', 'Tester', 'OP', 'OP', 'Assigned', 10.0, 10.0, 10.0)]
+        [['Innovation Test Data', 'Daamen Camille', 21, '4G EPC UGW capaciteit extensie', 50, 'Tester', 'OP', 'OP', 'Assigned', 10.0, 10.0, 10.0]]
+        time_line: list of 4 ints.
     Output:
         For each employee, a start row of available hours and an end row of difference hours.
         Difference = Available - sum(assigned)
@@ -3173,38 +3268,40 @@ def add_rows_phu_report(DBSession, data, time_line, contain_id=True):
     # Initialization
     new_data = []
     if data:
+        # Available hours of all employees in data, keyed by employee_id.
+        employee_hours = gen_employee_hours(DBSession, [row[2] for row in data], time_line)
         diff_rows = {}
         # diff_rows. A dictionary,
-        # key: Employee name, value: a tuple of two element.
+        # key: employee_id, value: a tuple of two element.
         # element 1 is the "header" in a difference row, element 2 is list of hours.
         # element 1 + element 2 we get a row in position of 'difference' for a employee
-        last_name = None
+        last_id = None
         week_qty = len(gen_yw_list(*time_line))
         col_qty = len(data[0])
         # Scan the data row by row.
         for asgn_row in data:
-            name = asgn_row[1]
-            if not diff_rows.get(name):  # New name found.
-                if last_name:
-                    new_data.append(diff_rows.get(last_name))  # append last name's difference row to new_data
+            emp_id = asgn_row[2]
+            if not diff_rows.get(emp_id):  # New employee found.
+                if last_id is not None:
+                    new_data.append(diff_rows.get(last_id))  # append last employee's difference row to new_data
                 avl_row = (asgn_row[:col_qty - week_qty - 2] + 
-                        [None, "Available"] + gen_employee_hours(DBSession, name, time_line))  # Create available row for this name
-                # Remove the project infor for this row. its location is 3 or 2 depends on the contain_id.
-                avl_row[3 if contain_id else 2] = None
-                # Updates when seeing a new name.
+                        [None, "Available"] + employee_hours[emp_id])  # Create available row for this employee
+                # Remove the project infor for this row.
+                avl_row[3] = None
+                # Updates when seeing a new employee.
                 new_data.append(avl_row)
-                diff_rows[name] = avl_row[:col_qty - week_qty - 1] + ["Difference"
+                diff_rows[emp_id] = avl_row[:col_qty - week_qty - 1] + ["Difference"
                     ] + avl_row[col_qty - week_qty:]
             # Updates at end of one loop
-            diff_hours = diff_rows[name][col_qty - week_qty:]
+            diff_hours = diff_rows[emp_id][col_qty - week_qty:]
             asgn_hours = asgn_row[col_qty - week_qty:]
-            diff_rows[name][col_qty - week_qty:] = [float_or_zero(diff_hours[i])
+            diff_rows[emp_id][col_qty - week_qty:] = [float_or_zero(diff_hours[i])
              - float_or_zero(asgn_hours[i]) for i in range(week_qty)]
             new_data.append(asgn_row)
-            last_name = name
-        # Update for the last name after leave the loop.
-        if last_name:
-            new_data.append(diff_rows.get(last_name))
+            last_id = emp_id
+        # Update for the last employee after leave the loop.
+        if last_id is not None:
+            new_data.append(diff_rows.get(last_id))
     return new_data
 
 def temp_phu_data(DBSession, data, hour_input, valid_time_line, project, calculate_diff = False):
@@ -3557,6 +3654,70 @@ def get_element_id(DBSession, element):
     session.close()
     return elmt_id
 
+def get_element_ids(DBSession, elements):
+    """
+    Bulk version of get_element_id().
+    Input:
+        elements: iterable of (node, hostname) pairs.
+    Output:
+        dictionary, key: (node, hostname), value: element_id.
+        Unknown pairs are left out.
+    """
+    elements = set(elements)
+    if not elements:
+        return {}
+    session = DBSession()
+    q = session.query(Nodes.node, Elements.hostname, Elements.element_id
+        ).filter(Elements.node_id == Nodes.node_id
+        ).filter(Nodes.node.in_(set(x[0] for x in elements))
+        ).filter(Elements.hostname.in_(set(x[1] for x in elements)))
+    element_ids = dict(((node, host), elmt_id) for node, host, elmt_id in q.all()
+        if (node, host) in elements)
+    session.close()
+    return element_ids
+
+def get_element_ids_by_name(DBSession, elements):
+    """
+    Bulk version of get_element_id(), in one query.
+    Input:
+        elements: iterable of strings, "BSC - EVO8100:GVTEGB1"
+    Output:
+        dictionary, key: element string, value: element_id.
+        Unknown elements are left out.
+    """
+    pairs = dict((x, tuple(x.split(':', 1))) for x in set(elements) if ':' in x)
+    element_ids = get_element_ids(DBSession, pairs.values())
+    return dict((x, element_ids[pair]) for x, pair in pairs.items() if pair in element_ids)
+
+def get_ids_by_name(DBSession, id_column, name_column, names):
+    """
+    Map names to ids in one query.
+    Output:
+        dictionary, key: name, value: id. Unknown names are left out.
+    Example:
+        get_ids_by_name(DBSession, Projects.project_id, Projects.name, ['VoLTE'])  ==> {u'VoLTE': 7}
+    """
+    names = set(names)
+    if not names:
+        return {}
+    session = DBSession()
+    ids = dict((name, x_id) for x_id, name in
+        session.query(id_column, name_column).filter(name_column.in_(names)).all())
+    session.close()
+    return ids
+
+def get_employee_ids(DBSession, employees):
+    """ Bulk version of get_employee_id(): dictionary employee name -> employee_id. """
+    return get_ids_by_name(DBSession, Employees.employee_id, Employees.name, employees)
+
+def get_project_ids(DBSession, projects):
+    """ Bulk version of get_project_id(): dictionary project name -> project_id. """
+    return get_ids_by_name(DBSession, Projects.project_id, Projects.name, projects)
+
+def get_usage_ids(DBSession, usages):
+    """ Bulk version of get_usage_id(): dictionary element usage -> element_usage_id. """
+    return get_ids_by_name(DBSession, ElementUsages.element_usage_id, ElementUsages.element_usage, usages)
+
 def get_node_id(DBSession, node):
     """
     input: node name
@@ -3634,11 +3795,12 @@ def get_request_element_info(REQUEST_ELEMENTS, form):
     
     return kwargs
 
-def update_template_content(DBSession, tpl_id, update_type, element, usage):
+def update_template_content(DBSession, tpl_id, update_type, element, usage, name_index=None):
     """
     Called like:
     kwargs['up_msg'] = update_template_content(DBSession, tpl_id, request.form.get('user_action_dyn'),
-            kwargs['selected_element'], kwargs['selected_usage'])
+            kwargs['selected_element'], kwargs['selected_usage'], NAME_INDEX)
+    name_index: optional NameIndex (see ipit_cache.py) resolving element and usage from memory.
     Policy:
     When (tpl_id, element_id) already exist, adding can succeed. But the usage_id overwrites.
     deleting also succeed.
@@ -3649,8 +3811,12 @@ def update_template_content(DBSession, tpl_id, update_type, element, usage):
     if not element or not usage:
         return u"Updating failed, make sure element and usage are not empty."
 
-    elmt_id = get_element_id(DBSession, element)
-    usg_id = get_usage_id(DBSession, usage)
+    if name_index is not None:
+        elmt_id = name_index.get(DBSession, get_element_ids_by_name, element)
+        usg_id = name_index.get(DBSession, get_usage_ids, usage)
+    else:
+        elmt_id = get_element_id(DBSession, element)
+        usg_id = get_usage_id(DBSession, usage)
     # Before modify, query to see if it already exist
     session = DBSession()
     old_record = session.query(ElementTemplateContents
@@ -3849,50 +4015,178 @@ def update_element_plan(DBSession, prj_id, time_line, tpl_content, delete=False)
     When delete is True, element plan is only deleted, but not updated.
 
     tpl_content: List [(element_id1, usage_id1), (element_id2, usage_id2), ...] or []
+
+    Set based, in one transaction: the template rows are upserted on the natural
+    key (project, element, year, week), see ipit_upsert.py. Deleting is one DELETE
+    over (project, template elements, week range). These core statements pass no
+    ORM hooks, so week_ordinal is set here, and the data version and the element
+    facts are refreshed explicitly.
     """
     prj_id = int(prj_id)
-    session = DBSession()
-    # Add element-usage
-    # Outside loop is each week
     yw_list = gen_yw_list(*time_line)
-    old_qty = 0
-    for y, w in yw_list:
-        for c in tpl_content:
-        # Inside loop is each element in the template.
-            # Clear the existing week plan of that week for that element
-            q = session.query(ProjectElementUsages)
-            q = q.filter(
-                 (ProjectElementUsages.project_id == prj_id) & 
-                 (ProjectElementUsages.year == y) & 
-                 (ProjectElementUsages.week == w) & 
-                 (ProjectElementUsages.element_id == c[0])
-				 )
-            records = q.all()
-            old_qty += len(records)
-            for r in records:
-                session.delete(r)
-            if delete == False:
-                new_record = ProjectElementUsages(year=y, week=w,
-                element_id=c[0], element_usage_id=c[1],
-                project_id=prj_id
-                )
-                session.add(new_record)
-                updated_records = len(tpl_content) * len(yw_list)
-            else:
-                updated_records = 0
-    # Return the result msg. It should start with SUC if successful.
+    # An element listed twice ends with its last usage, as when the template was applied row by row.
+    usages = dict(tpl_content)
+    table = ProjectElementUsages.__table__
+    rows = [{'year': y, 'week': w, 'week_ordinal': week_ordinal(y, w), 'element_id': element_id,
+        'element_usage_id': usage_id, 'project_id': prj_id, 'note': None}
+        for y, w in yw_list for element_id, usage_id in usages.items()]
+    session = DBSession()
     try:
+        old_qty = 0
+        written = 0
+        if rows:
+            window = ((table.c.project_id == prj_id) &
+                table.c.element_id.in_(usages.keys()) &
+                table.c.week_ordinal.between(week_ordinal(*yw_list[0]), week_ordinal(*yw_list[-1])))
+            if delete:
+                old_qty = written = session.execute(table.delete().where(window)).rowcount
+            else:  # The existing rows are replaced.
+                old_qty = session.execute(
+                    select([func.count()]).select_from(table).where(window)).scalar()
+                written = upsert(session, table, rows, ['element_usage_id', 'note'])
+        if delete:
+            updated_records = 0
+        else:
+            # Rows replaced by a later usage of the same element count as deleted too.
+            old_qty += (len(tpl_content) - len(usages)) * len(yw_list)
+            updated_records = len(tpl_content) * len(yw_list)
+        if written:
+            bump_data_version(session)
+            refresh_facts(session, ElementWeekFacts, {'project_id': [prj_id]})
+        session.commit()
+        msg = "SUCCESSFULL: Delete {0} old record(s) and add/update {1} records.".format(old_qty, updated_records)
+    except:
+        session.rollback()
+        msg = "Error: updating project element plan failed."
+    session.close()
+
+    return msg
+
+def template_source(tpl_name):
+    """
+    Source of expand_element_plan(): the (element_id, element_usage_id) rows of an element template.
+    """
+    return (select([ElementTemplateContents.element_id, ElementTemplateContents.element_usage_id])
+        .where(ElementTemplateContents.template_id == ElementTemplates.template_id)
+        .where(ElementTemplates.name == tpl_name))
+
+def project_week_source(prj_id, valid_time):
+    """
+    Source of expand_element_plan(): the (element_id, element_usage_id) rows of a project in one week,
+    like get_tpl_content_by_project().
+    valid_time: [year, week]
+    """
+    return (select([ProjectElementUsages.element_id, ProjectElementUsages.element_usage_id])
+        .where(ProjectElementUsages.project_id == int(prj_id))
+        .where(ProjectElementUsages.week_ordinal == week_ordinal(*valid_time)))
+
+def source_has_rows(DBSession, source):
+    """
+    True when a source of expand_element_plan() has rows, checked with EXISTS
+    instead of fetching them.
+    Example:
+        source_has_rows(DBSession, project_week_source(91, [2016, 1]))
+    """
+    session = DBSession()
+    found = session.query(exists(source)).scalar()
+    session.close()
+    return found
+
+def week_series(session, time_line):
+    """
+    Selectable of the weeks of a time line, with columns week_ordinal, year and week.
+    On Postgres it is generated by the DB with generate_series(). Elsewhere the
+    weeks are listed as a UNION ALL of literal rows.
+    """
+    sy, sw, ey, ew = time_line
+    if session.get_bind().dialect.name == 'postgresql':
+        series = func.generate_series(week_ordinal(sy, sw), week_ordinal(ey, ew)).alias('weeks')
+        ordinal = literal_column('weeks', Integer)
+        monday = literal(WEEK_ORDINAL_EPOCH) + ordinal * 7
+        return (select([ordinal.label('week_ordinal'),
+                cast(extract('isoyear', monday), Integer).label('year'),
+                cast(extract('week', monday), Integer).label('week')])
+            .select_from(series).alias('week_series'))
+    return union_all(*[select([literal(week_ordinal(y, w)).label('week_ordinal'),
+            literal(y).label('year'), literal(w).label('week')])
+        for y, w in gen_yw_list(*time_line)]).alias('week_series')
+
+def expand_element_plan(DBSession, prj_ids, time_line, source):
+    """
+    Set the element plan of projects in a time line from a template or from a copied week,
+    with one INSERT ... SELECT cross joining the projects, the source rows and the weeks.
+    Rows are upserted on the natural key (project, element, year, week), see ipit_upsert.py.
+    Inputs:
+        prj_ids: list of project ids, the same plan is applied to each of them.
+        time_line: valid time line.
+        source: select of (element_id, element_usage_id) rows, from template_source()
+                or project_week_source().
+    Outputs:
+        A message like update_element_plan().
+    Example:
+        expand_element_plan(DBSession, [91, 92], [2016, 1, 2016, 26], template_source('VoLTE core'))
+    """
+    prj_ids = [int(x) for x in prj_ids]
+    table = ProjectElementUsages.__table__
+    source = source.alias('source')
+    session = DBSession()
+    weeks = week_series(session, time_line)
+    rows = (select([Projects.project_id, source.c.element_id, source.c.element_usage_id,
+            weeks.c.year, weeks.c.week, weeks.c.week_ordinal, null()])
+        .where(Projects.project_id.in_(prj_ids)))
+    columns = ['project_id', 'element_id', 'element_usage_id', 'year', 'week', 'week_ordinal', 'note']
+    try:
+        # Counted first for the message: rows replaced, and rows written.
+        old_qty = session.execute(select([func.count()]).select_from(table).where(
+            table.c.project_id.in_(prj_ids) &
+            table.c.element_id.in_(select([source.c.element_id])) &
+            table.c.week_ordinal.between(week_ordinal(*time_line[:2]), week_ordinal(*time_line[2:]))
+            )).scalar()
+        updated_records = session.execute(select([func.count()]).select_from(rows.alias())).scalar()
+        if session.get_bind().dialect.name == 'postgresql':
+            statement = pg_insert(table).from_select(columns, rows)
+            written = session.execute(statement.on_conflict_do_update(
+                index_elements=natural_key(table),
+                set_={'element_usage_id': statement.excluded.element_usage_id, 'note': None},
+                where=(table.c.element_usage_id != statement.excluded.element_usage_id) |
+                    (table.c.note != None))).rowcount
+        else:
+            written = upsert(session, table, [dict(zip(columns, x)) for x in session.execute(rows)],
+                ['element_usage_id', 'note'])
+        if written:
+            bump_data_version(session)
+            refresh_facts(session, ElementWeekFacts, {'project_id': prj_ids})
         session.commit()
-        session.close()
         msg = "SUCCESSFULL: Delete {0} old record(s) and add/update {1} records.".format(old_qty, updated_records)
     except:
         session.rollback()
-        session.close()
         msg = "Error: updating project element plan failed."
+    session.close()
 
     return msg
 
-def filter_conflicts(data, contain_id=True, report_type = 'pcu'):
+def usage_codes(data, head):
+    """
+    Supporting function for filter_conflicts() and summary_conflict_msg().
+    Map the week cells of a PEU matrix to integer usage codes, once.
+    Input:
+        data: list of lists, rows of gen_peu_report.
+        head: int, number of columns before the week columns.
+    Output:
+        codes: 2-D numpy int array, one row per data row, one column per week.
+        codebook: list of usage strings. codebook[code] is the usage of a code.
+        Code 0 is the empty cell (None or '').
+    """
+    cells = [row[head:] for row in data]
+    codebook = [None] + list(set(chain.from_iterable(cells)) - set([None, '']))
+    dict_code = dict(izip(codebook, count()))
+    dict_code[''] = 0
+    codes = numpy.fromiter(imap(dict_code.__getitem__, chain.from_iterable(cells)),
+        numpy.int32, len(cells) * len(cells[0])).reshape(len(cells), -1)
+    return codes, codebook
+
+def filter_conflicts(data, contain_id=True, report_type = 'pcu', msg=None,
+        conflict_usages=CONFLICT_USAGES):
     """
     Used to fullfill project conflict detection.
     Input data comes from function gen_peu_report. It is a matrix of element weekly usages per element per project.
@@ -3903,86 +4197,76 @@ def filter_conflicts(data, contain_id=True, report_type = 'pcu'):
     * 595 is the element id.
     contain_id = False
     data[0] is [u'Groeneveld Martin', u'ARP HUB', u'ARP HUB 02', u'Future of Mobile Step 5', None, u'Configuratie aanpassing']
-    """
-    # Algorithm: scan through the rows in data.
-    # Save rows read from data to a temp varibale.
-    # if element changed, make a decision whether to keep last elements usages data.
-    # The decision is done by call a check function that can perform a check in if contains conflicts.
-    # Append those kept data to result.
-    def filter_one_group(matrix, contain_id, report_type):
-        """Local function. If matrix data contains conflicts, output the data. Else, output None.
-        Rule:
-        1 If matrix contains only 1 row. No conflicts.
-        2 If matrix contains multiple rows. Scan through the week columns.
-        Map usage string into ints: 1 and 0. 1 means can impact others, 0 means doesn't impact.
-        make running sum all ints belonging to one column.
-        make count of valid digits added to sum. (None or '' is not valid digits.)
-        If sum >= 1 and count >= 2: there is conflicts.
-        Eles, no conflicts.
-        Stop scanning through weeks if conflicts already detected.
-        """
-        H = len(matrix)  # Number of rows.
-        if H in [0]:
-            return None
-        head = 8 if contain_id else 5
-        W = len(matrix[0]) - head  # Number of weeks.
-        for col in range(W):
-            sums = 0
-            count = 0
-            for row in range(H):
-                if matrix[row][head + col] in CONFLICT_USAGES:
-                    sums += 1
-                if matrix[row][head + col]:  # It is not an empty field.
-                    count += 1
-                if count >= 2 and sums >= 1:
-                    return matrix
-            for row in range(H): # also add important usages for the weekly element report
-                if report_type == 'pwu'and matrix[row][head + col] in IMPORTANT_ELEMENT_USAGES:
-                    return [matrix[row]]
-
-    result = []
-    last_element = ''
-    temp = []
-    for row in data:
-        cur_elmt = '_'.join(row[2:4]) if contain_id else '_'.join(row[1:3])
-        # If a new element encountered?
-        if last_element and cur_elmt != last_element:
-            if report_type == 'pcu':
-                filtered = filter_one_group(temp, contain_id, report_type = 'pcu')  # filter_conflicts checks if there is conflicts. Only keep data if there is conflicts.
-            elif report_type == 'pwu':
-                filtered = filter_one_group(temp, contain_id, report_type = 'pwu')
-            if filtered:
-                result.extend(filtered)
-            temp = []  # clear temp variable.
-        temp.append(row)
-        last_element = cur_elmt
-    # When finished scanning, check last round.
-    if last_element:
-        if report_type == 'pcu':
-            filtered = filter_one_group(temp, contain_id, report_type = 'pcu')
-        elif report_type == 'pwu':
-            filtered = filter_one_group(temp, contain_id, report_type = 'pwu')
-        if filtered:
-            result.extend(filtered)
-    return result
-
+    Rule, per element group (consecutive rows of the same node and hostname):
+    1 A week has conflicts if it has >= 2 non empty cells and >= 1 usage in conflict_usages.
+      Pass get_conflict_usages() to follow the flags in the DB.
+      Then all rows of the group are kept.
+    2 For report_type 'pwu' only: in a week without conflicts, the first row using an
+      IMPORTANT_ELEMENT_USAGES usage is kept.
+    The first week (from the left) matching rule 1 or 2 decides for the group.
+    When msg is given, the message of summary_conflict_msg() is computed in the
+    same pass and (result, msg) is returned.
+    """
+    # Algorithm: map the week cells to usage codes once. Then per element group,
+    # count the non empty and the conflict cells of each week with numpy reductions.
+    head = 8 if contain_id else 5
+    if not data:
+        return ([], summary_conflict_msg(msg, [], contain_id)) if msg is not None else []
+    codes, codebook = usage_codes(data, head)
+    not_empty = codes > 0
+    is_conflict = numpy.array([x in conflict_usages for x in codebook])[codes]
+
+    # Element groups, as start row of each group.
+    elements = ['_'.join(row[2:4]) if contain_id else '_'.join(row[1:3]) for row in data]
+    starts = [0] + [i for i in range(1, len(elements)) if elements[i] != elements[i - 1]]
+    ends = starts[1:] + [len(data)]
+    conflict_weeks = ((numpy.add.reduceat(not_empty, starts, axis=0, dtype=int) >= 2) & 
+        numpy.logical_or.reduceat(is_conflict, starts, axis=0))
+    if report_type == 'pwu':
+        is_important = numpy.array([x in IMPORTANT_ELEMENT_USAGES for x in codebook])[codes]
+        hit_weeks = conflict_weeks | numpy.logical_or.reduceat(is_important, starts, axis=0)
+    else:
+        hit_weeks = conflict_weeks
+
+    kept = []  # Row numbers of data to keep.
+    for group in numpy.flatnonzero(hit_weeks.any(axis=1)):
+        start, end = starts[group], ends[group]
+        week = hit_weeks[group].argmax()  # First week with a hit.
+        if conflict_weeks[group, week]:
+            kept.extend(range(start, end))
+        else:
+            kept.append(start + is_important[start:end, week].argmax())
+    result = [data[i] for i in kept]
+    if msg is None:
+        return result
+    if msg.startswith('SUCC'):
+        msg = (summary_conflict_msg(msg, []) if not result else
+            "SUCCESSFUL: {} records retrieved.".format(not_empty[kept].sum()))
+    return result, msg
 
 def summary_conflict_msg(msg, data, contain_id=True):
     """
     When apply filter_conflicts on top of the peu data.
     We need to update the report message also.
+    filter_conflicts(..., msg=msg) gives the same message without another pass.
     """
     if not msg.startswith('SUCC'):
         return msg
-    H = len(data)
-    if H == 0:
+    if not data:
         return "SUCCESSFUL: 0 record retrieved."
     head = 8 if contain_id else 5
-    W = len(data[0]) - head
-    count = 0
-    for col in range(W):
-        for row in range(H):
-            if data[row][head + col]:
-                count += 1
-    return "SUCCESSFUL: {} records retrieved.".format(count)
+    return "SUCCESSFUL: {} records retrieved.".format((usage_codes(data, head)[0] > 0).sum())
 
+def gen_pwu_report(DBSession, rep, contain_id=True):
+    """
+    The weekly element report: the peu report of gen_peu_report() filtered by
+    filter_conflicts() with report_type 'pwu'.
+    Inputs:
+        rep: '/pwu_<int:prj_id>_<int:str_y>_<int:str_w>_<int:end_y>_<int:end_w>'
+    Outputs:
+        data, column_names, update_msg as gen_peu_report().
+    """
+    data, column_names, update_msg = gen_peu_report(DBSession, '/peu_' + rep[5:], contain_id)
+    data, update_msg = filter_conflicts(data, contain_id, report_type='pwu', msg=update_msg,
+        conflict_usages=get_conflict_usages(DBSession))
+    return data, column_names, update_msg
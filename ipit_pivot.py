@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" NumPy-backed pivot engine for IPIT reports.
+
+ipit_functions.cross_tab() pivots row by row in Python. Here every Y key and
+every week gets an integer code, and the values are written into a preallocated
+2-D array in one go:
+    hours (numbers) -> float64 array, NaN for empty cells.
+    usage names (strings) -> int16 code array + codebook, -1 for empty cells.
+Rows of Python objects are only built by PivotTable.to_rows(), at the edge where
+templates and the xlsx export need them.
+"""
+
+from itertools import count, imap, izip
+from operator import itemgetter
+
+import numpy
+
+FLOAT = 'float'
+CODE = 'code'
+
+# Marks an empty cell in a CODE pivot.
+NO_CODE = -1
+
+
+class PivotTable(object):
+    """
+    Result of pivot().
+    Attributes:
+        heads: list of lists, the leading (non pivoted) columns of each row.
+        values: 2-D numpy array, one row per head and one column per X.
+        kind: FLOAT or CODE.
+        codebook: list of the values behind the codes (kind CODE only).
+    """
+    def __init__(self, heads, values, kind, codebook=None):
+        self.heads = heads
+        self.values = values
+        self.kind = kind
+        self.codebook = codebook
+
+    def __len__(self):
+        return len(self.heads)
+
+    def to_rows(self):
+        """
+        Convert to the output format of cross_tab(): list of lists, the head
+        columns followed by one value per X, None for empty cells.
+        """
+        if not self.heads:
+            return []
+        if self.kind == CODE:
+            # Code -1 picks the trailing None.
+            lookup = numpy.array(list(self.codebook) + [None], dtype=object)
+            cells = lookup[self.values]
+        else:
+            cells = self.values.astype(object)
+            cells[numpy.isnan(self.values)] = None
+        return [head + row for head, row in zip(self.heads, cells.tolist())]
+
+
+def value_kind(values):
+    """ Return CODE if the first value which is not None is a string, otherwise FLOAT. """
+    for value in values:
+        if value is not None:
+            return CODE if isinstance(value, basestring) else FLOAT
+    return FLOAT
+
+
+def pivot(in_data, x_series, unique_len=1, kind=None):
+    """
+    Same pivot as ipit_functions.cross_tab(), but returns a PivotTable.
+    Input:
+        in_data: list of tuples (or lists). Last two columns are X and V.
+        x_series: list of X values.
+        unique_len: int, the first unique_len columns identify one Y.
+                    The other head columns are taken from the first record of a Y.
+        kind: FLOAT or CODE. By default guessed from the values, see value_kind().
+    Output:
+        PivotTable. When a (Y, X) cell occurs more than once the last record wins,
+        like in cross_tab().
+    Raises:
+        KeyError when an X of in_data is not in x_series.
+    """
+    if not in_data:
+        return PivotTable([], numpy.empty((0, len(x_series))), kind or FLOAT, [])
+    n_records = len(in_data)
+    keys = [record[:unique_len] for record in in_data]
+    if not isinstance(keys[0], tuple):  # Records given as lists.
+        keys = map(tuple, keys)
+    raw = map(itemgetter(-1), in_data)
+    if kind is None:
+        kind = value_kind(raw)
+
+    # Integer codes of Y keys, in order of first appearance. setdefault() with
+    # a counter gives, for each record, the index of the first record of its Y.
+    first_seen = numpy.fromiter(imap({}.setdefault, keys, count()), numpy.intp, n_records)
+    first_ind, y_codes = numpy.unique(first_seen, return_inverse=True)
+    heads = [list(in_data[i][:-2]) for i in first_ind]
+
+    # Integer codes of X.
+    dict_x = dict(izip(x_series, xrange(len(x_series))))
+    x_codes = numpy.fromiter(imap(dict_x.__getitem__, imap(itemgetter(-2), in_data)),
+        numpy.intp, n_records)
+
+    # When a cell occurs more than once, keep only its last record.
+    shape = (len(first_ind), len(x_series))
+    cells = y_codes * shape[1] + x_codes
+    if numpy.bincount(cells, minlength=1).max() > 1:
+        last = n_records - 1 - numpy.unique(cells[::-1], return_index=True)[1]
+        y_codes, x_codes = y_codes[last], x_codes[last]
+        raw = [raw[i] for i in last]
+
+    if kind == CODE:
+        codebook = list(set(raw) - set([None]))
+        dict_v = dict(izip(codebook, xrange(len(codebook))))
+        dict_v[None] = NO_CODE
+        values = numpy.full(shape, NO_CODE, dtype=numpy.int16)
+        values[y_codes, x_codes] = numpy.fromiter(imap(dict_v.__getitem__, raw),
+            numpy.int16, len(raw))
+        return PivotTable(heads, values, kind, codebook)
+
+    values = numpy.full(shape, numpy.nan)
+    values[y_codes, x_codes] = numpy.array(raw, dtype=float)  # None -> NaN
+    return PivotTable(heads, values, kind)
+
+
+def cross_tab(in_data, x_series, unique_len=1, kind=None):
+    """
+    Drop-in replacement of ipit_functions.cross_tab() on top of pivot().
+    Numbers come back as float.
+    """
+    return pivot(in_data, x_series, unique_len, kind).to_rows()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" Precomputed weekly reports for IPIT.
+
+The weekly element report (pwu) and the conflict report (pcu) of all projects
+are opened by everyone, mostly for the current week. A ReportPrecomputer
+thread puts them in the report cache (ipit_cache.py) for the current and the
+next ISO week, so the /reports page and the pwu download are served from
+memory. The keys of these reports are pinned in the cache, so other reports
+never evict them.
+
+The thread polls the data version. When the version changed it waits until
+the version stayed the same for one more check before building the reports
+again, so a burst of edits costs one rebuild. A changed week, or a report
+missing from the cache (e.g. after ReportCache.clear()), is built at once.
+
+The cache lives in the memory of a server process, so each process runs its
+own thread, started on its first request. With N gunicorn workers a data
+change therefore costs N rebuilds, one per process, about one interval after
+the last edit.
+"""
+
+import threading
+from datetime import date, timedelta
+
+from ipit_cache import get_data_version
+from ipit_cache import report_key
+from ipit_functions import gen_peu_report
+from ipit_functions import gen_pwu_report
+from ipit_functions import gen_request_report
+
+PRECOMPUTE_INTERVAL = 60  # Seconds between two checks of the data version.
+
+
+def precompute_weeks(today):
+    """
+    The weeks to precompute: current and next ISO week.
+    Example:
+        precompute_weeks(date(2016, 12, 28)) ==> [(2016, 52), (2017, 1)]
+    """
+    return [today.isocalendar()[:2], (today + timedelta(days=7)).isocalendar()[:2]]
+
+
+def precomputed_reports(weeks):
+    """
+    The reports to precompute for all projects, as (report, rep, kwargs of ReportCache.get).
+    Per week: pwu and pcu of the /reports page, pwu and pru of the pwu download.
+    """
+    reports = []
+    for year, week in weeks:
+        rep = '0_{0}_{1}_{0}_{1}'.format(year, week)
+        reports.extend([
+            (gen_pwu_report, '/pwu_' + rep, {}),
+            (gen_peu_report, '/peu_' + rep, {'conflicts_only': True}),
+            (gen_pwu_report, '/pwu_' + rep, {'contain_id': False}),
+            (gen_request_report, '/pru_' + rep, {'contain_id': False}),
+            ])
+    return reports
+
+
+def precomputed_keys(weeks):
+    """ The ReportCache keys of precomputed_reports(weeks). """
+    return [report_key(report, rep, **kwargs) for report, rep, kwargs in precomputed_reports(weeks)]
+
+
+def precompute_reports(DBSession, cache, weeks):
+    """
+    Put the reports of precomputed_reports() in cache and pin them.
+    Inputs:
+        cache: ReportCache.
+        weeks: list of (year, week).
+    Outputs:
+        A string describing the result.
+    """
+    reports = precomputed_reports(weeks)
+    cache.pin(precomputed_keys(weeks))
+    for report, rep, kwargs in reports:
+        cache.get(DBSession, report, rep, **kwargs)
+    return u"SUCCESSFUL: {0} reports precomputed.".format(len(reports))
+
+
+class ReportPrecomputer(threading.Thread):
+    """
+    Daemon thread keeping the weekly reports of the current data version in a cache.
+    Example:
+        precomputer = ReportPrecomputer(DBSession, REPORT_CACHE)
+        precomputer.start()
+    """
+    def __init__(self, DBSession, cache, interval=PRECOMPUTE_INTERVAL, today=date.today):
+        threading.Thread.__init__(self, name='ReportPrecomputer')
+        self.daemon = True
+        self.DBSession = DBSession
+        self.cache = cache
+        self.interval = interval
+        self.today = today
+        self.state = None  # (data version, weeks) of the last precomputation.
+        self.seen = None  # (data version, weeks) of the last check.
+        self.message = None
+        self._stopped = threading.Event()
+
+    def precompute(self):
+        """
+        Precompute the reports when they are missing from the cache, the week
+        changed, or the data version changed and stayed the same since the
+        previous check. Returns True when done.
+        """
+        weeks = precompute_weeks(self.today())
+        state = (get_data_version(self.DBSession), weeks)
+        seen, self.seen = self.seen, state
+        if state == self.state:
+            if all(key in self.cache for key in precomputed_keys(weeks)):
+                return False
+        elif self.state is not None and weeks == self.state[1] and state != seen:
+            return False  # Data version still changing, wait for the next check.
+        self.message = precompute_reports(self.DBSession, self.cache, weeks)
+        self.state = state
+        return True
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.precompute()
+            except Exception as e:  # Keep running, the DB may be back on the next check.
+                self.message = u"FAILED: {0}".format(e)
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        """ Ask the thread to end after its current check. """
+        self._stopped.set()
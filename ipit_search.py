@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" Typeahead search for IPIT.
+
+The edit pages used to render every element (node:hostname) and every
+employee as an <option>. They now ask /search_elements or /search_employees
+for the top matches of what the user typed.
+
+A SearchIndex is built in memory from the (id, name) list of a source. It
+has a prefix index, a sorted list of the words of each name, and a trigram
+index on the whole name for matches in the middle of a word. Like the
+ReferenceCache (ipit_cache.py), the index of a source is stamped with the
+DataVersions counters of its tables and built again when one of them changed.
+"""
+
+import re
+import threading
+from bisect import bisect_left
+from functools import partial
+
+from ipit_cache import get_table_versions
+from ipit_functions import gen_element_list
+from ipit_functions import gen_employee_list
+
+SEARCH_LIMIT = 20  # Default number of matches returned.
+MAX_SEARCH_LIMIT = 100
+
+# Source name -> (function(DBSession) returning [(id, name)], tables it reads).
+SEARCH_SOURCES = {
+    'elements': (partial(gen_element_list, contain_id=True), ['Elements', 'Nodes']),
+    'employees': (partial(gen_employee_list, contain_id=True), ['Employees']),
+    }
+
+
+def trigrams(text):
+    """
+    Set of the 3 character substrings of text.
+    Example:
+        trigrams(u'gvtep') ==> set([u'gvt', u'vte', u'tep'])
+    """
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def name_words(name):
+    """
+    Lower case search words of a name: the name itself and its parts.
+    Example:
+        name_words(u'PCRF:GVTEPP3') ==> [u'pcrf:gvtepp3', u'pcrf', u'gvtepp3']
+    """
+    name = name.lower()
+    words = [x for x in re.split(r'[\s:_\-/.]+', name) if x]
+    return [name] + [x for x in words if x != name]
+
+
+class SearchIndex(object):
+    """
+    Prefix and trigram index over a list of (id, name).
+    Example:
+        index = SearchIndex([(2, u'PCRF:GVTEPP4'), (1, u'PCRF:GVTEPP3')])
+        index.search(u'gvtepp') ==> [(1, u'PCRF:GVTEPP3'), (2, u'PCRF:GVTEPP4')]
+    """
+    def __init__(self, items):
+        self.items = sorted(items, key=lambda x: x[1].lower())
+        self.names = [x[1].lower() for x in self.items]
+        self.words = sorted((word, i) for i, name in enumerate(self.names)
+            for word in name_words(name))
+        self.trigrams = {}  # trigram -> set of item numbers
+        for i, name in enumerate(self.names):
+            for trigram in trigrams(name):
+                self.trigrams.setdefault(trigram, set()).add(i)
+
+    def prefix_matches(self, term):
+        """ Numbers of the items with a word starting with term. """
+        matches = set()
+        i = bisect_left(self.words, (term,))
+        while i < len(self.words) and self.words[i][0].startswith(term):
+            matches.add(self.words[i][1])
+            i += 1
+        return matches
+
+    def substring_matches(self, term):
+        """ Numbers of the items whose name contains term, which is at least 3 characters. """
+        candidates = None
+        for trigram in trigrams(term):
+            found = self.trigrams.get(trigram, set())
+            candidates = found if candidates is None else candidates & found
+            if not candidates:
+                return set()
+        return set(i for i in candidates if term in self.names[i])
+
+    def search(self, term, limit=SEARCH_LIMIT):
+        """
+        Return the first limit items matching term, as (id, name).
+        Names starting with term come first, then names with a word starting
+        with term, then names containing it. In each group names are sorted.
+        """
+        term = term.strip().lower()
+        if not term:
+            return self.items[:limit]
+        prefix = self.prefix_matches(term)
+        ranked = sorted(prefix, key=lambda i: (not self.names[i].startswith(term), i))
+        if len(ranked) < limit and len(term) >= 3:
+            ranked += sorted(self.substring_matches(term) - prefix)
+        return [self.items[i] for i in ranked[:limit]]
+
+
+class TypeaheadSearch(object):
+    """
+    Per process search indexes of the SEARCH_SOURCES. A search checks the
+    DataVersions counters of the tables of its source, see get_table_versions().
+    Example:
+        typeahead = TypeaheadSearch()
+        matches = typeahead.search(DBSession, 'elements', u'gvtep', limit=10)
+    """
+    def __init__(self):
+        self._indexes = {}  # source -> (versions, SearchIndex)
+        self._lock = threading.Lock()
+
+    def index(self, DBSession, source):
+        """ Return the SearchIndex of source, built on the current data. """
+        gen_items, tables = SEARCH_SOURCES[source]
+        versions = get_table_versions(DBSession, tables)
+        with self._lock:
+            entry = self._indexes.get(source)
+            if entry is not None and entry[0] == versions:
+                return entry[1]
+        index = SearchIndex(gen_items(DBSession))
+        with self._lock:
+            self._indexes[source] = (versions, index)
+        return index
+
+    def search(self, DBSession, source, term, limit=SEARCH_LIMIT):
+        """
+        Return the matches of term in source, see SearchIndex.search().
+        Raises KeyError when source is not in SEARCH_SOURCES.
+        """
+        return self.index(DBSession, source).search(term, max(1, min(limit, MAX_SEARCH_LIMIT)))
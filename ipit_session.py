@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" Request-scoped DB session for the IPIT web server.
+
+The helpers of ipit_functions.py take a session factory and do
+    session = DBSession()
+    ...
+    session.close()
+so a page calling ten helpers checked out ten connections. RequestSession is
+such a factory which hands out the same session for the whole Flask request.
+That session is bound to one connection, checked out on first use and given
+back at the end of the request.
+
+Session.close() on a session bound to a connection rolls back the open
+transaction and detaches the objects, but keeps the connection. So each
+helper still works in its own transaction, as before, and its results stay
+usable after close(). The session is callable and returns itself, so it can
+be handed to the helpers in place of the factory too.
+"""
+
+from flask import g
+from flask import has_request_context
+
+
+class RequestSession(object):
+    """
+    Session factory giving one session and one connection per Flask request.
+    Outside a request (threads, command line) it gives a new session per call,
+    like the wrapped factory.
+    Example:
+        DBSession = RequestSession(sessionmaker(bind=ENGINE))
+        app.teardown_request(DBSession.remove)
+    """
+    def __init__(self, DBSession):
+        self.DBSession = DBSession
+        # Same class as the sessions of DBSession, so its event listeners apply.
+        self.session_class = type('RequestScopedSession', (DBSession.class_,),
+            {'__call__': lambda session: session})
+
+    def __call__(self):
+        if not has_request_context():
+            return self.DBSession()
+        if getattr(g, 'ipit_session', None) is None:
+            g.ipit_connection = self.DBSession.kw['bind'].connect()
+            g.ipit_session = self.session_class(bind=g.ipit_connection,
+                **dict((k, v) for k, v in self.DBSession.kw.items() if k != 'bind'))
+        return g.ipit_session
+
+    def remove(self, exception=None):
+        """ Close the session and give its connection back, at the end of a request. """
+        session = g.pop('ipit_session', None)
+        if session is not None:
+            session.close()
+            g.pop('ipit_connection').close()
@@ -4,11 +4,20 @@
 import unittest
 import sqlite3
 import re
+import zipfile
+import os
+import shutil
+import tempfile
+import json
+from io import BytesIO
 from datetime import date
 
 from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import inspect
 from sqlalchemy.orm import sessionmaker
 from werkzeug.datastructures import ImmutableMultiDict
+from flask import Flask
 
 from ipit_functions import is_valid_time as ivt
 from ipit_functions import is_valid_email as ive
@@ -50,6 +59,8 @@ from ipit_functions import get_allocation_plan_by_prjid #db
 from ipit_functions import update_human_allocation #db
 from ipit_functions import gen_phu_report
 from ipit_functions import gen_peu_report
+from ipit_functions import gen_pwu_report
+from ipit_functions import iter_peu_report
 from ipit_functions import get_employee_byid
 from ipit_functions import is_valid_name as ivn
 from ipit_functions import is_valid_regnum as ivr
@@ -70,6 +81,9 @@ from ipit_functions import is_valid_year_week as vyw
 from ipit_functions import get_tpl_content_by_name #db
 from ipit_functions import get_tpl_content_by_project #db
 from ipit_functions import update_element_plan #db
+from ipit_functions import expand_element_plan #db
+from ipit_functions import template_source
+from ipit_functions import project_week_source
 from ipit_functions import get_element_id #db
 from ipit_functions import get_usage_id #db
 from ipit_functions import filter_conflicts as fc
@@ -104,8 +118,85 @@ from ipit_functions import add_department
 from ipit_functions import is_valid_department
 from ipit_functions import del_department
 from ipit_functions import update_department
+from ipit_functions import query_time_window
+from ipit_functions import cross_tab
+from ipit_functions import pivot_weeks
+from ipit_functions import get_conflicts_by_element_week
+from ipit_functions import get_element_ids
+from ipit_functions import get_element_ids_by_name
+from ipit_functions import is_valid_element
+from ipit_functions import get_usage_ids
+from ipit_functions import conflicted_elements_query
+from ipit_functions import gen_employee_hours
+
+from ipit_calendar import add_availability
+from ipit_calendar import del_availability
+from ipit_calendar import get_free_hours
+from ipit_functions import get_supply_hours
+from ipit_functions import source_has_rows
+from ipit_calendar import gen_availability_list
+
+from ipit_cache import ReportCache
+from ipit_cache import track_writes
+from ipit_cache import get_data_version
+from ipit_cache import get_data_versions
+from ipit_cache import ReferenceCache
+from ipit_cache import NameIndex
+from ipit_cache import report_key
+from ipit_search import SearchIndex
+from ipit_search import TypeaheadSearch
+from ipit_search import SEARCH_LIMIT
+from ipit_search import MAX_SEARCH_LIMIT
+from db_migrations import migrate
+from db_migrations import lookup_index
+from db_migrations import LOOKUP_INDEXES
+from db_migrations import add_calendar_and_job_tables
+
+from ipit_facts import track_facts
+from ipit_facts import rebuild_facts
+
+from ipit_export import write_report
+from ipit_export import build_report
+from ipit_export import cached_report_path
+
+from ipit_jobs import claim_job
+from ipit_jobs import run_job
+from ipit_jobs import get_job
+from ipit_jobs import next_job
+from ipit_jobs import parse_spec
+
+from ipit_precompute import precompute_weeks
+from ipit_precompute import ReportPrecomputer
+
+from ipit_session import RequestSession
+
+import ipit_functions
+import ipitserver
+
+from ipit_pivot import pivot
+from ipit_pivot import CODE
 
 from database_setup import Base
+from database_setup import week_ordinal
+from database_setup import ordinal_to_yw
+from database_setup import date_week_ordinal
+from database_setup import ProjectPlans
+from database_setup import Departments
+from database_setup import Roles
+from database_setup import Domains
+from database_setup import Nodes
+from database_setup import Elements
+from database_setup import Employees
+from database_setup import Projects
+from database_setup import ElementUsages
+from database_setup import ProjectElementUsages
+from database_setup import ProjectHumanUsages
+from database_setup import ElementTemplates
+from database_setup import ElementTemplateContents
+from database_setup import DataVersions
+from database_setup import HumanWeekFacts
+from ipit_upsert import natural_key
+from ipit_upsert import upsert
 
 from credential import is_valid_username as ivu
 from credential import is_valid_password as ivp
@@ -311,6 +402,86 @@ class TestValidDateTime(unittest.TestCase):
         self.assertEqual(vdt(["12-04-2016"], [u"10:00"], ["12-04-2016"], [u"8:00"], ["my_element"]),
                          (None, ["", "", "", "Time {0}:00 must be earlier than {1}:00 for Element {2}".format(10, 8, "my_element")]))
 
+class TestIsValidElement(unittest.TestCase):
+    def test_is_valid_element(self):
+        self.assertEqual((True, ""), is_valid_element({u'PCRF:GVTEPP3': 1}, [u'PCRF:GVTEPP3', u'']))
+        self.assertEqual((False, u"Unknown element PCRF:GVTE, please choose one from the list."),
+            is_valid_element({u'PCRF:GVTEPP3': 1}, [u'PCRF:GVTEPP3', u'PCRF:GVTE']))
+
+class TestTypeaheadSearch(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex([(3, u'SBC:XGVTEPP1'), (2, u'PCRF:GVTEPP4'), (1, u'PCRF:GVTEPP3'),
+            (4, u'GVTE:HOST1')])
+        ENGINE = create_engine('sqlite://')
+        Base.metadata.create_all(ENGINE)
+        self.DBSession = sessionmaker(bind=ENGINE)
+        session = self.DBSession()
+        session.add_all([Departments(department_id=1, department='Test Data'),
+            Domains(domain_id=1, domain='Core'), Nodes(node_id=1, node='PCRF', domain_id=1),
+            Elements(element_id=1, node_id=1, hostname='GVTEPP3'),
+            Elements(element_id=2, node_id=1, hostname='GVTEPP4'),
+            Employees(employee_id=1, name='Alice', department_id=1, registration_number='a00001',
+                if_left=False)])
+        session.commit()
+        session.close()
+
+    def get(self, url):
+        """ Status and JSON of a request to the server, on the test DB. """
+        saved = ipitserver.DBSession, ipitserver.TYPEAHEAD_SEARCH
+        ipitserver.DBSession, ipitserver.TYPEAHEAD_SEARCH = RequestSession(self.DBSession), TypeaheadSearch()
+        try:
+            with ipitserver.app.test_request_context(url):
+                response = ipitserver.app.make_response(ipitserver.app.dispatch_request())
+                return response.status_code, json.loads(response.get_data()) if response.status_code == 200 else None
+        finally:
+            ipitserver.DBSession, ipitserver.TYPEAHEAD_SEARCH = saved
+
+    def test_prefix(self):
+        # Names starting with the term first, then names with a word starting with it, then the rest.
+        self.assertEqual([(4, u'GVTE:HOST1'), (1, u'PCRF:GVTEPP3'), (2, u'PCRF:GVTEPP4'),
+            (3, u'SBC:XGVTEPP1')], self.index.search(u' gvte'))
+        self.assertEqual([(1, u'PCRF:GVTEPP3')], self.index.search(u'pcrf:gvtepp3'))
+        self.assertEqual([(4, u'GVTE:HOST1')], self.index.search(u'GVTE', limit=1))
+
+    def test_substring(self):
+        self.assertEqual([(1, u'PCRF:GVTEPP3'), (2, u'PCRF:GVTEPP4'), (3, u'SBC:XGVTEPP1')],
+            self.index.search(u'gvtepp'))
+        self.assertEqual([(3, u'SBC:XGVTEPP1')], self.index.search(u'vtepp1'))
+        self.assertEqual([], self.index.search(u'vt'))  # Too short for the trigrams.
+        self.assertEqual([], self.index.search(u'unknown'))
+
+    def test_empty_term(self):
+        self.assertEqual([4, 1], [x[0] for x in self.index.search(u'', limit=2)])
+
+    def test_typeahead_search(self):
+        typeahead = TypeaheadSearch()
+        self.assertEqual([(1, u'PCRF:GVTEPP3'), (2, u'PCRF:GVTEPP4')],
+            typeahead.search(self.DBSession, 'elements', u'gvte'))
+        self.assertEqual([(1, u'Alice')], typeahead.search(self.DBSession, 'employees', u'ali'))
+        session = self.DBSession()
+        session.add(DataVersions(name='Elements', version=1))  # As track_writes() does on a write.
+        session.query(Elements).filter(Elements.element_id == 2).update({'hostname': 'GVTEPP5'})
+        session.commit()
+        session.close()
+        self.assertEqual([(2, u'PCRF:GVTEPP5')],
+            typeahead.search(self.DBSession, 'elements', u'gvtepp5'))
+
+    def test_route(self):
+        self.assertEqual((200, [{'id': 1, 'label': 'PCRF:GVTEPP3', 'value': 'PCRF:GVTEPP3'}]),
+            self.get('/search_elements?term=gvte&limit=1'))
+        self.assertEqual((200, [{'id': 1, 'label': 'Alice', 'value': 'Alice'}]),
+            self.get('/search_employees?term=ALI'))
+        self.assertEqual((404, None), self.get('/search_projects?term=volte'))
+
+    def test_route_limit(self):
+        session = self.DBSession()
+        session.add_all([Elements(node_id=1, hostname='HOST{0}'.format(i)) for i in range(120)])
+        session.commit()
+        session.close()
+        self.assertEqual(MAX_SEARCH_LIMIT, len(self.get('/search_elements?term=host&limit=1000')[1]))
+        self.assertEqual(1, len(self.get('/search_elements?term=host&limit=0')[1]))
+        self.assertEqual(SEARCH_LIMIT, len(self.get('/search_elements?term=host&limit=x')[1]))
+
 class TestGenYwList(unittest.TestCase):
     def test_same_year(self):
         self.assertEqual(
@@ -338,6 +509,44 @@ class TestGenYwList(unittest.TestCase):
             2016, 11, 2015, 14
             )
 
+class TestWeekOrdinal(unittest.TestCase):
+    def test_first_week(self):
+        self.assertEqual(week_ordinal(2014, 1), 0)
+
+    def test_year_with_53_weeks(self):
+        self.assertEqual(week_ordinal(2015, 53), 104)
+        self.assertEqual(week_ordinal(2016, 1), 105)
+
+    def test_consecutive_over_years(self):
+        ordinals = [week_ordinal(y, w) for y, w in gyl(2014, 50, 2017, 3)]
+        self.assertEqual(ordinals, range(49, 49 + len(ordinals)))
+
+    def test_round_trip(self):
+        for y, w in gyl(2015, 50, 2016, 3):
+            self.assertEqual(ordinal_to_yw(week_ordinal(y, w)), (y, w))
+
+    def test_date(self):
+        self.assertEqual(date_week_ordinal(date(2016, 1, 3)), week_ordinal(2015, 53))  # Sunday
+        self.assertEqual(date_week_ordinal(date(2016, 1, 4)), week_ordinal(2016, 1))  # Monday
+
+class TestQueryTimeWindow(unittest.TestCase):
+    def setUp(self):
+        self.session = sessionmaker()()
+
+    def gen_sql(self, time_line):
+        query = query_time_window(self.session, ProjectPlans, time_line,
+            ProjectPlans.year, ProjectPlans.week, ProjectPlans.hours)
+        return str(query.statement.compile(compile_kwargs={'literal_binds': True}))
+
+    def test_one_range_over_years(self):
+        sql = self.gen_sql([2015, 50, 2017, 3])
+        self.assertEqual(sql.count('BETWEEN'), 1)
+        self.assertIn('BETWEEN 101 AND 159', sql)
+        self.assertNotIn('WHERE "ProjectPlans".year', sql)
+
+    def test_same_year(self):
+        self.assertIn('BETWEEN 53 AND 55', self.gen_sql([2015, 2, 2015, 4]))
+
 class TestGenYearWeekColumns(unittest.TestCase):
     def gen_outs(self, start_year, start_week, end_year, end_week):
         self.o1, self.o2, self.o3  = gywc(start_year,
@@ -600,6 +809,657 @@ class TestGetById(unittest.TestCase):
     def test_noneinput(self):
         self.assertEqual(None, gbi(None))
 
+class TestPivot(unittest.TestCase):
+    x_series = [(2015, 50), (2015, 51), (2015, 52), (2015, 53), (2016, 1)]
+
+    def test_same_as_cross_tab(self):
+        in_data = [
+            ('CS2', (2015, 50), 12.0),
+            ('CS2', (2015, 51), 12.0),
+            ('SBC Swap', (2016, 1), 2.5),
+            ('CS2', (2015, 53), None)]
+        self.assertEqual(cross_tab(in_data, self.x_series),
+            pivot(in_data, self.x_series).to_rows())
+
+    def test_unique_len(self):
+        # Note is not part of the key, the head comes from the first record.
+        in_data = [
+            ('node1', 'host1', 'note a', (2015, 50), 'Shared'),
+            ('node1', 'host2', 'note b', (2015, 51), 'Exclusive'),
+            ('node1', 'host1', 'note c', (2015, 52), 'Update')]
+        table = pivot(in_data, self.x_series, 2)
+        self.assertEqual(CODE, table.kind)
+        self.assertEqual(table.values.shape, (2, 5))
+        self.assertEqual(cross_tab(in_data, self.x_series, 2), table.to_rows())
+
+    def test_last_record_wins(self):
+        in_data = [
+            ['A', (2015, 50), 1.0],
+            ['A', (2015, 50), 2.0],
+            ['B', (2015, 51), 3.0]]
+        self.assertEqual([['A', 2.0, None, None, None, None],
+            ['B', None, 3.0, None, None, None]],
+            pivot(in_data, self.x_series).to_rows())
+
+    def test_empty(self):
+        self.assertEqual([], pivot([], self.x_series).to_rows())
+
+    def test_unknown_week(self):
+        with self.assertRaises(KeyError):
+            pivot([('A', (2014, 1), 1.0)], self.x_series)
+
+class TestPivotWeeks(unittest.TestCase):
+    def setUp(self):
+        ENGINE = create_engine('sqlite://')
+        Base.metadata.create_all(ENGINE)
+        self.session = sessionmaker(bind=ENGINE)()
+        self.session.add_all([Departments(department_id=1, department='Test Data'),
+            Roles(role_id=1, role='Tester'), Roles(role_id=2, role='Manager')])
+        for (y, w), hours, note in zip(gyl(2015, 52, 2016, 1), [8, 4, 2], ['Migration', None, 'Pilot']):
+            self.session.add(ProjectPlans(project_id=1, department_id=1, role_id=1,
+                year=y, week=w, hours=hours, note=note))
+        self.session.add(ProjectPlans(project_id=1, department_id=1, role_id=2,
+            year=2016, week=2, hours=1))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def gen_outs(self, backend, others=()):
+        time_line = [2015, 52, 2016, 2]
+        q = (query_time_window(self.session, ProjectPlans, time_line)
+            .filter(ProjectPlans.department_id == Departments.department_id)
+            .filter(ProjectPlans.role_id == Roles.role_id)
+            .order_by(Roles.role.desc()))
+        return pivot_weeks(q, ProjectPlans, time_line,
+            [Departments.department, Roles.role], ProjectPlans.hours, others,
+            to_float=True, backend=backend)
+
+    def test_sql(self):
+        self.assertEqual(([['Test Data', 'Tester', 8.0, 4.0, 2.0, None],
+            ['Test Data', 'Manager', None, None, None, 1.0]], 4), self.gen_outs('sql'))
+
+    def test_same_as_python(self):
+        self.assertEqual(self.gen_outs('python'), self.gen_outs('sql'))
+
+    def test_others(self):
+        # The greatest note of the line, whatever the backend.
+        self.assertEqual([['Test Data', 'Tester', 'Pilot'], ['Test Data', 'Manager', None]],
+            [x[:3] for x in self.gen_outs('sql', [ProjectPlans.note])[0]])
+        self.assertEqual(self.gen_outs('python', [ProjectPlans.note]),
+            self.gen_outs('sql', [ProjectPlans.note]))
+
+class TestConflictsByElementWeek(unittest.TestCase):
+    def setUp(self):
+        ENGINE = create_engine('sqlite://')
+        Base.metadata.create_all(ENGINE)
+        self.DBSession = sessionmaker(bind=ENGINE)
+        session = self.DBSession()
+        session.add_all([Departments(department_id=1, department='Test Data'),
+            Domains(domain_id=1, domain='Core'), Nodes(node_id=1, node='PCRF', domain_id=1),
+            Elements(element_id=1, node_id=1, hostname='GVTEPP3'),
+            Elements(element_id=2, node_id=1, hostname='GVTEPP4'),
+            Employees(employee_id=1, name='Alice', department_id=1, registration_number='a00001',
+                if_left=False),
+            Projects(project_id=1, name='VoLTE', test_manager_id=1, active=True, flag='PROJECT'),
+            Projects(project_id=2, name='X+1', test_manager_id=1, active=True, flag='PROJECT'),
+            ElementUsages(element_usage_id=1, element_usage='Shared')])
+        for project_id, (y, w) in [(1, (2016, 1)), (2, (2016, 1)), (1, (2016, 2))]:
+            session.add(ProjectElementUsages(element_id=1, project_id=project_id,
+                element_usage_id=1, year=y, week=w))
+        session.commit()
+        session.close()
+
+    def test_conflicts(self):
+        conflicts = get_conflicts_by_element_week(self.DBSession,
+            [(1, 2016, 1), (1, 2016, 2), (2, 2016, 1), (None, 2016, 1)])
+        self.assertEqual({(1, 2016, 1): [['Alice', 'VoLTE', 'Shared'], ['Alice', 'X+1', 'Shared']],
+            (1, 2016, 2): [['Alice', 'VoLTE', 'Shared']]}, conflicts)
+
+    def test_conflicted_elements_query(self):
+        session = self.DBSession()
+        q = session.query(conflicted_elements_query(session, [2016, 1, 2016, 2]))
+        self.assertEqual([], q.all())  # 'Shared' is no conflict usage.
+        session.query(ElementUsages).update({'conflict': True})
+        self.assertEqual([(1,)], q.all())
+        self.assertEqual([], session.query(
+            conflicted_elements_query(session, [2016, 2, 2016, 2])).all())  # Only 1 project.
+        session.close()
+
+    def test_element_ids(self):
+        self.assertEqual({('PCRF', 'GVTEPP4'): 2},
+            get_element_ids(self.DBSession, [('PCRF', 'GVTEPP4'), ('PCRF', 'unknown')]))
+        self.assertEqual({'PCRF:GVTEPP4': 2},
+            get_element_ids_by_name(self.DBSession, ['PCRF:GVTEPP4', 'PCRF:unknown', 'GVTEPP4']))
+
+class FactsTestCase(unittest.TestCase):
+    """
+    Base of the tests on the usage and fact tables: an in-memory DB with one
+    department, role, element, employee, project and usage, facts tracked.
+    Each test class adds the usages it needs with add_rows().
+    """
+    def setUp(self):
+        ENGINE = create_engine('sqlite://')
+        Base.metadata.create_all(ENGINE)
+        self.DBSession = sessionmaker(bind=ENGINE)
+        track_facts(self.DBSession)
+        self.add_rows([Departments(department_id=1, department='Test Data'),
+            Roles(role_id=1, role='Tester'),
+            Domains(domain_id=1, domain='Core'), Nodes(node_id=1, node='PCRF', domain_id=1),
+            Elements(element_id=1, node_id=1, hostname='GVTEPP3'),
+            Employees(employee_id=1, name='Alice', department_id=1, registration_number='a00001',
+                if_left=False, contract_type='Intern'),
+            Projects(project_id=1, name='VoLTE', test_manager_id=1, active=True, flag='PROJECT'),
+            ElementUsages(element_usage_id=1, element_usage='Shared')])
+
+    def add_rows(self, rows):
+        session = self.DBSession()
+        session.add_all(rows)
+        session.commit()
+        session.close()
+
+    def reports(self):
+        return (gen_peu_report(self.DBSession, '/peu_0_2016_1_2016_2')[0],
+            gen_phu_report(self.DBSession, '/phu_1_2016_1_2016_2')[0])
+
+class TestWeekFacts(FactsTestCase):
+    def setUp(self):
+        FactsTestCase.setUp(self)
+        self.add_rows([ProjectElementUsages(element_id=1, project_id=1, element_usage_id=1,
+            year=2016, week=1),
+            ProjectHumanUsages(employee_id=1, project_id=1, role_id=1, year=2016, week=2, hours=8)])
+
+    def test_insert(self):
+        self.assertEqual(([['Alice', 1, 'PCRF', 'GVTEPP3', 1, 'VoLTE', 1, None, 'Shared', None]],
+            [['Test Data', 'Alice', 1, 'VoLTE', 1, 'Tester', 'Intern', None, 'Assigned', None, 8.0]]),
+            self.reports())
+
+    def test_rename_and_delete(self):
+        session = self.DBSession()
+        session.query(Projects).get(1).name = 'VoLTE 2'
+        session.query(Nodes).get(1).node = 'PCRF 2'
+        session.delete(session.query(ProjectHumanUsages).one())
+        session.commit()
+        session.close()
+        self.assertEqual(([['Alice', 1, 'PCRF 2', 'GVTEPP3', 1, 'VoLTE 2', 1, None, 'Shared', None]],
+            []), self.reports())
+
+    def test_iter_peu_report(self):
+        rows, column_names = iter_peu_report(self.DBSession, '/peu_0_2016_1_2016_2')
+        data, names, msg = gen_peu_report(self.DBSession, '/peu_0_2016_1_2016_2', contain_id=False)
+        self.assertEqual((data, names), (list(rows), column_names))
+
+    def test_rebuild(self):
+        before = self.reports()
+        self.assertEqual(u"SUCCESSFUL: 1 element facts and 1 human facts rebuilt.",
+            rebuild_facts(self.DBSession))
+        self.assertEqual(before, self.reports())
+
+class TestWeekFactsPythonPivot(TestWeekFacts):
+    """ The same reports with the 'python' backend of pivot_weeks(). """
+    def setUp(self):
+        TestWeekFacts.setUp(self)
+        self.backend, ipit_functions.PIVOT_BACKEND = ipit_functions.PIVOT_BACKEND, 'python'
+
+    def tearDown(self):
+        ipit_functions.PIVOT_BACKEND = self.backend
+
+class TestPhuReportSameName(unittest.TestCase):
+    def setUp(self):
+        ENGINE = create_engine('sqlite://')
+        Base.metadata.create_all(ENGINE)
+        self.DBSession = sessionmaker(bind=ENGINE)
+        session = self.DBSession()
+        session.add_all([
+            Employees(employee_id=1, name='Alice', department_id=1, registration_number='a00001',
+                if_left=False, hours_available=40),
+            Employees(employee_id=2, name='Alice 2', department_id=1, registration_number='a00002',
+                if_left=False, hours_available=32)])
+        # The report reads the facts, written here with the same name for both employees.
+        for usage_id, employee_id, project_id, project, hours in [(1, 1, 1, 'A', 8),
+                (2, 2, 2, 'B', 4), (3, 1, 3, 'C', 8)]:
+            session.add(HumanWeekFacts(project_human_usage_id=usage_id,
+                week_ordinal=week_ordinal(2016, 1), project_id=project_id, project_name=project,
+                employee_id=employee_id, employee_name='Alice', department_id=1,
+                department='Test Data', role_id=1, role='Tester', hours=hours))
+        session.commit()
+        session.close()
+
+    def test_same_name(self):
+        data = gen_phu_report(self.DBSession, '/phu_0_2016_1_2016_1')[0]
+        self.assertEqual([(1, None, 'Available', 40.0), (1, 'A', 'Assigned', 8.0),
+            (1, 'C', 'Assigned', 8.0), (1, None, 'Difference', 24.0),
+            (2, None, 'Available', 32.0), (2, 'B', 'Assigned', 4.0), (2, None, 'Difference', 28.0)],
+            [(x[2], x[3], x[8], x[9]) for x in data])
+
+class TestReportJobs(FactsTestCase):
+    def setUp(self):
+        FactsTestCase.setUp(self)
+        self.add_rows([ProjectElementUsages(element_id=1, project_id=1, element_usage_id=1,
+            year=2016, week=1)])
+        track_writes(self.DBSession)
+
+    def test_report_job(self):
+        job_dir = tempfile.mkdtemp()
+        try:
+            job_id, start = claim_job(self.DBSession, 'peu_0_2016_1_2016_2')
+            self.assertEqual((job_id, False), claim_job(self.DBSession, 'peu_0_2016_1_2016_2'))
+            self.assertEqual(job_id, next_job(self.DBSession))
+            self.assertEqual(None, next_job(self.DBSession))  # Taken by the first worker.
+            run_job(job_id, self.DBSession, job_dir)
+            job = get_job(self.DBSession, job_id)
+            self.assertEqual((True, 'done', 1, 'ProjectElementUsages_AllProject_2016_1_2016_2.xlsx'),
+                (start, job['status'], job['progress'], job['filename']))
+            self.assertTrue(os.path.exists(job['path']))
+            self.assertEqual(0, get_data_version(self.DBSession))  # Jobs are no data.
+            job_id, start = claim_job(self.DBSession, 'pxu_0_2016_1_2016_2')
+            run_job(job_id, self.DBSession, job_dir)
+            self.assertEqual('failed', get_job(self.DBSession, job_id)['status'])
+            self.assertEqual((job_id, True), claim_job(self.DBSession, 'pxu_0_2016_1_2016_2'))  # Retry.
+        finally:
+            shutil.rmtree(job_dir)
+
+class TestUpdateElementPlan(FactsTestCase):
+    def setUp(self):
+        FactsTestCase.setUp(self)
+        self.add_rows([ProjectElementUsages(element_id=1, project_id=1, element_usage_id=1,
+            year=2016, week=1),
+            ProjectHumanUsages(employee_id=1, project_id=1, role_id=1, year=2016, week=2, hours=8)])
+
+    def test_update_element_plan(self):
+        self.assertEqual("SUCCESSFULL: Delete 1 old record(s) and add/update 2 records.",
+            update_element_plan(self.DBSession, 1, [2016, 1, 2016, 2], [(1, 1)]))
+        self.assertEqual(([['Alice', 1, 'PCRF', 'GVTEPP3', 1, 'VoLTE', 1, None, 'Shared', 'Shared']],
+            [['Test Data', 'Alice', 1, 'VoLTE', 1, 'Tester', 'Intern', None, 'Assigned', None, 8.0]]),
+            self.reports())
+        session = self.DBSession()
+        self.assertEqual([105, 106], sorted(x[0] for x in
+            session.query(ProjectElementUsages.week_ordinal)))
+        session.close()
+        self.assertEqual("SUCCESSFULL: Delete 2 old record(s) and add/update 0 records.",
+            update_element_plan(self.DBSession, 1, [2016, 1, 2016, 2], [(1, 1)], delete=True))
+        self.assertEqual([], self.reports()[0])
+
+class TestUpdateHumanAllocationPerWeek(FactsTestCase):
+    def setUp(self):
+        FactsTestCase.setUp(self)
+        self.add_rows([ProjectHumanUsages(employee_id=1, project_id=1, role_id=1, year=2016, week=2, hours=8)])
+
+    def test_update_human_allocation_per_week(self):
+        self.assertEqual("SUCCESSFUL: 1 record(s) added, 0 record(s) updated and 1 record(s) deleted.",
+            update_human_allocation_per_week(self.DBSession, [u'4', u''], 1, (1, 'VoLTE'),
+                [2016, 1, 2016, 2]))
+        self.assertEqual([['Test Data', 'Alice', 1, 'VoLTE', 1, 'Tester', 'Intern', None,
+            'Assigned', 4.0, None]], self.reports()[1])
+        self.assertEqual("SUCCESSFUL: 0 record(s) added, 1 record(s) updated and 0 record(s) deleted.",
+            update_human_allocation_per_week(self.DBSession, [u'6', u''], 1, (0, 'All Projects'),
+                [2016, 1, 2016, 2]))
+        self.assertEqual(6.0, self.reports()[1][0][9])
+
+class TestUpsertAllocation(FactsTestCase):
+    def setUp(self):
+        FactsTestCase.setUp(self)
+        track_writes(self.DBSession)
+
+    def test_upsert_allocation(self):
+        self.assertEqual("SUCCESSFUL: 2 records updated.",
+            update_human_allocation(self.DBSession, [2016, 1, 2016, 2], '8', 1, 1, 1))
+        session = self.DBSession()
+        ids = sorted(x[0] for x in session.query(ProjectHumanUsages.project_human_usage_id))
+        session.close()
+        self.assertEqual((2, 1), (len(ids), get_data_version(self.DBSession)))
+        update_human_allocation(self.DBSession, [2016, 1, 2016, 2], '8', 1, 1, 1)  # No change.
+        self.assertEqual(1, get_data_version(self.DBSession))
+        self.assertEqual("SUCCESSFUL: 2 records updated.",
+            update_human_allocation(self.DBSession, [2016, 1, 2016, 2], '6', 1, 1, 1, 'Pilot'))
+        session = self.DBSession()
+        self.assertEqual([(ids[0], 6, 'Pilot'), (ids[1], 6, 'Pilot')],
+            sorted(session.query(ProjectHumanUsages.project_human_usage_id,
+                ProjectHumanUsages.hours, ProjectHumanUsages.note)))
+        session.close()
+        self.assertEqual([6.0, 6.0], self.reports()[1][0][9:])
+        self.assertEqual("SUCCESSFUL: 2 records deleted",
+            update_human_allocation(self.DBSession, [2016, 1, 2016, 2], '0', 1, 1, 1))
+
+class TestUpsert(unittest.TestCase):
+    def setUp(self):
+        ENGINE = create_engine('sqlite://')
+        Base.metadata.create_all(ENGINE)
+        self.DBSession = sessionmaker(bind=ENGINE)
+        self.table = ProjectPlans.__table__
+
+    def plan(self, week, hours, role_id=1):
+        return {'project_id': 1, 'department_id': 1, 'role_id': role_id, 'year': 2016, 'week': week,
+            'week_ordinal': week_ordinal(2016, week), 'hours': hours, 'note': None}
+
+    def plans(self):
+        session = self.DBSession()
+        plans = sorted((x.role_id, x.week, float(x.hours)) for x in session.query(ProjectPlans))
+        session.close()
+        return plans
+
+    def test_natural_key(self):
+        self.assertEqual(['project_id', 'department_id', 'role_id', 'year', 'week'],
+            natural_key(self.table))
+        self.assertEqual(['project_id', 'element_id', 'year', 'week'],
+            natural_key(ProjectElementUsages.__table__))
+        self.assertRaises(ValueError, natural_key, DataVersions.__table__)
+
+    def test_insert_and_update(self):
+        session = self.DBSession()
+        self.assertEqual(2, upsert(session, self.table, [self.plan(1, 8), self.plan(2, 8)], ['hours']))
+        self.assertEqual(0, upsert(session, self.table, [self.plan(1, 8)], ['hours']))  # No change.
+        self.assertEqual(1, upsert(session, self.table, [self.plan(1, 8), self.plan(2, 4)], ['hours']))
+        session.commit()
+        session.close()
+        self.assertEqual([(1, 1, 8.0), (1, 2, 4.0)], self.plans())
+
+    def test_null_key(self):
+        session = self.DBSession()
+        upsert(session, self.table, [self.plan(1, 8, role_id=None)], ['hours'])
+        upsert(session, self.table, [self.plan(1, 8, role_id=None)], ['hours'])
+        session.commit()
+        session.close()
+        self.assertEqual([(None, 1, 8.0), (None, 1, 8.0)], self.plans())  # NULL never matches.
+
+class TestExpandElementPlan(FactsTestCase):
+    def setUp(self):
+        FactsTestCase.setUp(self)
+        self.add_rows([ProjectElementUsages(element_id=1, project_id=1, element_usage_id=1,
+            year=2016, week=1)])
+
+    def test_expand_element_plan(self):
+        session = self.DBSession()
+        session.add_all([Projects(project_id=2, name='RCS', active=True, flag='PROJECT'),
+            ElementUsages(element_usage_id=2, element_usage='Software update'),
+            ElementTemplates(template_id=1, name='Core'),
+            ElementTemplateContents(template_id=1, element_id=1, element_usage_id=2)])
+        session.commit()
+        session.close()
+        self.assertEqual("SUCCESSFULL: Delete 1 old record(s) and add/update 4 records.",
+            expand_element_plan(self.DBSession, [1, 2], [2016, 1, 2016, 2], template_source('Core')))
+        self.assertEqual([[None, None, 'PCRF', 'GVTEPP3', 1, 'RCS', 2, None, 'Software update',
+            'Software update'], ['Alice', 1, 'PCRF', 'GVTEPP3', 1, 'VoLTE', 1, None, 'Software update',
+            'Software update']], self.reports()[0])
+        self.assertEqual("SUCCESSFULL: Delete 1 old record(s) and add/update 2 records.",
+            expand_element_plan(self.DBSession, [2], [2016, 2, 2016, 3],
+                project_week_source(1, [2016, 1])))
+        self.assertTrue(source_has_rows(self.DBSession, project_week_source(1, [2016, 1])))
+        self.assertFalse(source_has_rows(self.DBSession, project_week_source(1, [2016, 5])))
+
+class TestWriteReport(unittest.TestCase):
+    def sheet_rows(self, xlsx, sheet=1):
+        """ Return the numbers of the non empty rows of a worksheet. """
+        with zipfile.ZipFile(xlsx) as z:
+            xml = z.read('xl/worksheets/sheet{0}.xml'.format(sheet))
+        return map(int, re.findall(r'<row r="(\d+)"', xml))
+
+    def test_groups_and_styles(self):
+        xlsx = BytesIO()
+        rows = iter([['A', 1], ['A', -1], ['B', 0]])
+        qty = write_report(xlsx, [{'title': 'Report', 'header': ['Name', 'Qty'], 'rows': rows,
+                'group_column': 0, 'row_style': lambda row: 'highlight' if row[1] else None,
+                'cell_styles': lambda row: {1: 'negative'} if row[1] < 0 else {}},
+            {'title': 'Empty', 'header': ['Name'], 'rows': []}])
+        self.assertEqual([3, 0], qty)
+        self.assertEqual([1, 2, 3, 4, 6], self.sheet_rows(xlsx))  # Blank row 5 before 'B'.
+        self.assertEqual([1, 2], self.sheet_rows(xlsx, 2))
+
+    def test_build_report(self):
+        xlsx = build_report([{'title': 'Report', 'header': ['Name'], 'rows': [['A']]}])
+        self.assertEqual([1, 2, 3], self.sheet_rows(xlsx))
+        xlsx.close()
+
+    def test_cached_report_path(self):
+        cache_dir = tempfile.mkdtemp()
+        calls = []
+        def gen_sheets():
+            calls.append(1)
+            return [{'title': 'Report', 'header': ['Name'], 'rows': [['A']]}]
+        try:
+            path = cached_report_path(cache_dir, 1, 'report.xlsx', gen_sheets)
+            self.assertEqual(path, cached_report_path(cache_dir, 1, 'report.xlsx', gen_sheets))
+            self.assertEqual(1, len(calls))
+            cached_report_path(cache_dir, 2, 'report.xlsx', gen_sheets)
+            self.assertEqual(['2_report.xlsx'], os.listdir(cache_dir))  # Version 1 removed.
+        finally:
+            shutil.rmtree(cache_dir)
+
+class TestGenEmployeeHours(unittest.TestCase):
+    def setUp(self):
+        ENGINE = create_engine('sqlite://')
+        Base.metadata.create_all(ENGINE)
+        self.DBSession = sessionmaker(bind=ENGINE)
+        session = self.DBSession()
+        session.add_all([Departments(department_id=1, department='Test Data'),
+            Employees(employee_id=21, name='Alice', department_id=1, registration_number='a00001',
+                if_left=False, hours_available=40),
+            Employees(employee_id=25, name='Bob', department_id=1, registration_number='b00001',
+                if_left=False, hours_available=32)])
+        session.commit()
+        session.close()
+
+    def test_by_id(self):
+        self.assertEqual({21: [40.0, 40.0, 40.0], 25: [32.0, 32.0, 32.0]},
+            gen_employee_hours(self.DBSession, [21, 25, 21], [2016, 10, 2016, 12]))
+
+    def test_no_employees(self):
+        self.assertEqual({}, gen_employee_hours(self.DBSession, [], [2016, 10, 2016, 12]))
+
+    def test_overrides(self):
+        add_availability(self.DBSession, 21, [2016, 11, 2016, 11], 0, 'Holiday')
+        add_availability(self.DBSession, 25, [2015, 50, 2016, 10], 24)
+        add_availability(self.DBSession, 25, [2016, 10, 2016, 10], 16)  # Later one wins.
+        self.assertEqual({21: [40.0, 0.0, 40.0], 25: [16.0, 32.0, 32.0]},
+            gen_employee_hours(self.DBSession, [21, 25], [2016, 10, 2016, 12]))
+        availability_id = gen_availability_list(self.DBSession, 21)[0][0]
+        self.assertEqual(u"FAILED: availability {0} doesn't exist for this employee.".format(
+            availability_id), del_availability(self.DBSession, 25, availability_id))
+        del_availability(self.DBSession, 21, availability_id)
+        self.assertEqual([], gen_availability_list(self.DBSession, 21))
+
+    def test_free_hours(self):
+        session = self.DBSession()
+        session.add(ProjectHumanUsages(employee_id=21, project_id=1, role_id=1,
+            year=2016, week=12, hours=30))
+        session.commit()
+        session.close()
+        ids, hours = get_free_hours(self.DBSession, [21], [2016, 11, 2016, 12])
+        self.assertEqual(([21], [[40.0, 10.0]]), (ids, hours.tolist()))
+        self.assertEqual([['Alice', 21, 40.0, 10.0], ['Bob', 25, 32.0, 32.0]],
+            get_supply_hours(self.DBSession, [25, 21], [2016, 11, 2016, 12]))
+
+class TestReportCache(unittest.TestCase):
+    def setUp(self):
+        ENGINE = create_engine('sqlite://')
+        Base.metadata.create_all(ENGINE)
+        self.DBSession = sessionmaker(bind=ENGINE)
+        track_writes(self.DBSession)
+        self.calls = []
+
+    def report(self, DBSession, rep, contain_id=True):
+        self.calls.append((rep, contain_id))
+        return [[rep, 1]], ['Name', 'Qty'], "SUCCESSFUL: 1 records retrieved."
+
+    def test_hit_and_copy(self):
+        cache = ReportCache()
+        data = cache.get(self.DBSession, self.report, '/peu_0_2016_1_2016_2')[0]
+        data[0][1] = 2  # Callers may modify their copy.
+        self.assertEqual([['/peu_0_2016_1_2016_2', 1]],
+            cache.get(self.DBSession, self.report, '/peu_0_2016_1_2016_2')[0])
+        cache.get(self.DBSession, self.report, '/peu_0_2016_1_2016_2', contain_id=False)
+        self.assertEqual(2, len(self.calls))
+        stats = cache.stats()
+        self.assertEqual((1, 2, 2), (stats['hits'], stats['misses'], stats['entries']))
+        self.assertTrue(stats['bytes'] > 0)
+
+    def test_writes_invalidate(self):
+        cache = ReportCache()
+        cache.get(self.DBSession, self.report, '/peu_0_2016_1_2016_2')
+        add_department(self.DBSession, 'Test Data')  # ORM insert.
+        self.assertEqual(1, get_data_version(self.DBSession))
+        cache.get(self.DBSession, self.report, '/peu_0_2016_1_2016_2')
+        session = self.DBSession()
+        session.query(Departments).filter(Departments.department == 'Test Data').delete()  # Bulk.
+        session.commit()
+        session.close()
+        self.assertEqual(2, get_data_version(self.DBSession))
+        cache.get(self.DBSession, self.report, '/peu_0_2016_1_2016_2')
+        self.assertEqual(3, len(self.calls))
+
+    def test_read_only_and_rollback(self):
+        gen_department_list(self.DBSession)
+        session = self.DBSession()
+        session.add(Departments(department='Test Data'))
+        session.flush()
+        session.rollback()
+        session.close()
+        self.assertEqual(0, get_data_version(self.DBSession))
+
+    def test_lru_eviction(self):
+        cache = ReportCache(max_entries=2)
+        for rep in ['/a', '/b', '/a', '/c', '/a', '/b']:
+            cache.get(self.DBSession, self.report, rep)
+        self.assertEqual(['/a', '/b', '/c', '/b'], [x[0] for x in self.calls])
+        self.assertEqual(2, cache.stats()['evictions'])
+
+    def test_name_index(self):
+        index = NameIndex()
+        session = self.DBSession()
+        usage = ElementUsages(element_usage='Shared')
+        session.add(usage)
+        session.commit()
+        usage_id = usage.element_usage_id
+        self.assertEqual({'Shared': usage_id}, index.resolve(self.DBSession, get_usage_ids, ['Shared', 'Unknown']))
+        self.assertEqual(usage_id, index.get(self.DBSession, get_usage_ids, 'Shared'))
+        self.assertEqual((1, 2), (index.stats()['hits'], index.stats()['misses']))
+        usage.element_usage = 'Exclusive'  # A rename drops the index.
+        session.commit()
+        session.close()
+        self.assertRaises(KeyError, index.get, self.DBSession, get_usage_ids, 'Shared')
+        self.assertEqual(usage_id, index.get(self.DBSession, get_usage_ids, 'Exclusive'))
+        self.assertEqual(1, index.stats()['entries'])
+
+    def test_reference_cache(self):
+        cache = ReferenceCache()
+        add_department(self.DBSession, 'Test Data')
+        self.assertEqual(['Test Data'], cache.get(self.DBSession, gen_department_list))
+        cache.get(self.DBSession, gen_department_list)[0] = 'Changed'  # Callers get a copy.
+        self.assertEqual(['Test Data'], cache.get(self.DBSession, gen_department_list))
+        add_applicant(self.DBSession, 'Test Applicant')  # Other table, the list stays cached.
+        self.assertEqual(['Test Data'], cache.get(self.DBSession, gen_department_list))
+        self.assertEqual((3, 1), (cache.stats()['hits'], cache.stats()['misses']))
+        update_department(self.DBSession, 'Test Data', 'Test Data 2')
+        self.assertEqual(['Test Data 2'], cache.get(self.DBSession, gen_department_list))
+        self.assertEqual([(1, 'Test Data 2')],
+            cache.get(self.DBSession, gen_department_list, contain_id=True))
+        self.assertEqual((1, 0, 2), get_data_versions(self.DBSession,
+            ['Applicants', 'Roles', 'Departments']))
+
+    def test_precompute(self):
+        self.assertEqual([(2016, 52), (2017, 1)], precompute_weeks(date(2016, 12, 28)))
+        cache = ReportCache()
+        precomputer = ReportPrecomputer(self.DBSession, cache, today=lambda: date(2016, 12, 28))
+        self.assertTrue(precomputer.precompute())
+        self.assertEqual("SUCCESSFUL: 8 reports precomputed.", precomputer.message)
+        self.assertFalse(precomputer.precompute())  # Same data version and weeks.
+        cache.get(self.DBSession, gen_pwu_report, '/pwu_0_2016_52_2016_52')
+        self.assertEqual((1, 8), (cache.stats()['hits'], cache.stats()['misses']))
+        add_department(self.DBSession, 'Test Data')
+        self.assertFalse(precomputer.precompute())  # Waits until the data version is stable.
+        self.assertTrue(precomputer.precompute())
+        self.assertEqual(16, cache.stats()['misses'])
+        cache.clear()  # Missing reports are built again at once.
+        self.assertTrue(precomputer.precompute())
+        self.assertEqual(24, cache.stats()['misses'])
+
+    def test_precompute_pinned(self):
+        cache = ReportCache(max_entries=8)
+        precomputer = ReportPrecomputer(self.DBSession, cache, today=lambda: date(2016, 12, 28))
+        self.assertTrue(precomputer.precompute())
+        for rep in ['/a', '/b', '/c']:
+            cache.get(self.DBSession, self.report, rep)
+        self.assertEqual((8, 8), (cache.stats()['entries'], cache.stats()['pinned']))
+        self.assertFalse(precomputer.precompute())  # Other reports didn't evict the pinned ones.
+        self.assertTrue(report_key(gen_pwu_report, '/pwu_0_2017_1_2017_1', contain_id=False) in cache)
+
+class TestRequestSession(unittest.TestCase):
+    def setUp(self):
+        ENGINE = create_engine('sqlite://')
+        Base.metadata.create_all(ENGINE)
+        DBSession = sessionmaker(bind=ENGINE)
+        track_writes(DBSession)
+        self.DBSession = RequestSession(DBSession)
+        self.app = Flask(__name__)
+        self.app.teardown_request(self.DBSession.remove)
+        self.checkouts = []
+        event.listen(ENGINE.pool, 'checkout', lambda *args: self.checkouts.append(1))
+        self.version_reads = []
+        event.listen(ENGINE, 'before_cursor_execute', lambda conn, cursor, statement, *args:
+            self.version_reads.append(1) if 'FROM "DataVersions"' in statement else None)
+
+    def test_one_connection_per_request(self):
+        with self.app.test_request_context('/'):
+            add_department(self.DBSession, 'Test Data')
+            self.assertEqual(['Test Data'], gen_department_list(self.DBSession))
+            self.assertEqual(1, get_data_version(self.DBSession))  # Events of the factory apply.
+            session = self.DBSession()
+            self.assertTrue(session is self.DBSession() and session is session())
+        self.assertEqual(1, len(self.checkouts))
+        gen_department_list(self.DBSession)  # Outside a request: a session per call.
+        gen_department_list(self.DBSession)
+        self.assertEqual(3, len(self.checkouts))
+
+    def test_table_versions_per_request(self):
+        cache = ReferenceCache()
+        index = NameIndex()
+        with self.app.test_request_context('/'):
+            cache.get(self.DBSession, gen_department_list)
+            cache.get(self.DBSession, gen_role_list)
+            index.resolve(self.DBSession, get_usage_ids, ['Shared'])
+            self.assertEqual(1, len(self.version_reads))
+            add_department(self.DBSession, 'Test Data')  # A write drops the memo.
+            self.assertEqual(['Test Data'], cache.get(self.DBSession, gen_department_list))
+            self.assertEqual(2, len(self.version_reads))
+        with self.app.test_request_context('/'):
+            self.assertEqual(['Test Data'], cache.get(self.DBSession, gen_department_list))
+            self.assertEqual(3, len(self.version_reads))
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.ENGINE = create_engine('sqlite://')
+        self.calls = []
+
+    def migration(self, ENGINE):
+        self.calls.append(ENGINE)
+
+    def failing_migration(self, ENGINE):
+        raise ValueError("Migration failed.")
+
+    def test_migrate(self):
+        self.assertEqual([1, 2], migrate(self.ENGINE, [(2, self.migration), (1, self.migration)]))
+        self.assertEqual([], migrate(self.ENGINE, [(2, self.migration), (1, self.migration)]))
+        self.assertEqual(2, len(self.calls))
+        # A failing migration isn't recorded, it runs again next time.
+        self.assertRaises(ValueError, migrate, self.ENGINE, [(1, self.migration), (3, self.failing_migration)])
+        self.assertEqual([3], migrate(self.ENGINE, [(1, self.migration), (3, self.migration)]))
+        self.assertEqual([1, 2, 3], [x[0] for x in self.ENGINE.execute(
+            'SELECT version FROM "SchemaMigrations" ORDER BY version')])
+
+    def test_calendar_and_job_tables(self):
+        add_calendar_and_job_tables(self.ENGINE)
+        add_calendar_and_job_tables(self.ENGINE)  # Safe to run more than once.
+        tables = inspect(self.ENGINE).get_table_names()
+        self.assertIn('EmployeeAvailabilities', tables)
+        self.assertIn('ReportJobs', tables)
+
+    def test_lookup_indexes(self):
+        Base.metadata.create_all(self.ENGINE)
+        inspector = inspect(self.ENGINE)
+        for name in LOOKUP_INDEXES:
+            index = lookup_index(name)
+            self.assertIn(name, [x['name'] for x in inspector.get_indexes(index.table.name)])
+
 class TestNormalizeDBValue(unittest.TestCase):
     def test_remove_spaces(self):
         self.assertEqual('DBValue Test', ndb('DBValue               Test'))
@@ -688,6 +1548,17 @@ class TestFilterConflicts(unittest.TestCase):
 
         self.assertEqual(output_data, fc(input_data, contain_id=False, report_type='pwu'))
 
+    def test_msg_same_pass(self):
+        data = [[u'TM', u'PCRF', u'GVTEPP2', u'VoLTE', None, u'Software update', None],
+            [u'TM', u'PCRF', u'GVTEPP2', u'X+1', None, u'Training', u'Training'],
+            [u'TM', u'SeGw', u'GVTEEF1', u'VoLTE', None, u'Training', None]]
+        self.assertEqual((data[:2], "SUCCESSFUL: 3 records retrieved."),
+            fc(data, contain_id=False, msg="SUCCESSFUL: 5 records retrieved."))
+        self.assertEqual(([data[2]], "SUCCESSFUL: 1 records retrieved."),
+            fc(data[2:], contain_id=False, report_type='pwu', msg="SUCCESSFUL: 1 records retrieved."))
+        self.assertEqual(([], "SUCCESSFUL: 0 record retrieved."),
+            fc(data[2:], contain_id=False, msg="SUCCESSFUL: 1 records retrieved."))
+
 class TestSummaryConflictMessage(unittest.TestCase):
     def test_fail(self):
         self.assertEqual("fail", scm(msg="fail", data = [], contain_id = True))
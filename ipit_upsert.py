@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" Bulk writes on the usage tables of IPIT.
+
+ProjectPlans, ProjectHumanUsages and ProjectElementUsages are unique on their
+natural key: project, employee or department or element, role, year and week
+(see the UniqueConstraint of each table). upsert() writes rows with
+INSERT ... ON CONFLICT DO UPDATE on that key, instead of deleting and
+inserting them again. Rows whose values didn't change aren't touched, so
+frequent edits leave no dead tuples behind.
+
+These are core statements: they pass no ORM hooks. Rows must carry
+week_ordinal, and callers refresh the data version and the fact tables.
+"""
+
+from sqlalchemy import UniqueConstraint
+from sqlalchemy import and_
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+# Rows per multi-row INSERT statement.
+BULK_INSERT_ROWS = 500
+
+
+def natural_key_constraint(table):
+    """ The UniqueConstraint of a usage table. """
+    constraints = [x for x in table.constraints if isinstance(x, UniqueConstraint)]
+    if len(constraints) != 1:
+        raise ValueError("Table {0} has no single natural key.".format(table.name))
+    return constraints[0]
+
+
+def natural_key(table):
+    """
+    Column names of the unique constraint of a usage table.
+    Example:
+        natural_key(ProjectElementUsages.__table__) ==> ['project_id', 'element_id', 'year', 'week']
+    """
+    return [x.name for x in natural_key_constraint(table).columns]
+
+
+def bulk_insert(session, table, rows):
+    """ Insert a list of row dicts with multi-row INSERTs, in the transaction of session. """
+    for i in range(0, len(rows), BULK_INSERT_ROWS):
+        session.execute(table.insert().values(rows[i:i + BULK_INSERT_ROWS]))
+
+
+def upsert(session, table, rows, update_columns):
+    """
+    Insert rows, or update the rows with the same natural key.
+    Inputs:
+        session: an open session, the caller commits.
+        table: a usage table, like ProjectPlans.__table__.
+        rows: list of dicts with all columns to insert.
+        update_columns: names of the columns set on an existing row.
+    Outputs:
+        Number of rows inserted or changed. Existing rows with the same values don't count.
+    Example:
+        upsert(session, ProjectPlans.__table__, [{'project_id': 91, 'department_id': 1,
+            'role_id': 3, 'year': 2016, 'week': 1, 'week_ordinal': 105, 'hours': 8.0}], ['hours'])
+    Note: NULL never equals NULL in a unique constraint, rows with a NULL key column are always inserted.
+    """
+    keys = natural_key(table)
+    qty = 0
+    if session.get_bind().dialect.name == 'postgresql':
+        for i in range(0, len(rows), BULK_INSERT_ROWS):
+            statement = pg_insert(table).values(rows[i:i + BULK_INSERT_ROWS])
+            statement = statement.on_conflict_do_update(index_elements=keys,
+                set_=dict((x, statement.excluded[x]) for x in update_columns),
+                where=or_(*[table.c[x].is_distinct_from(statement.excluded[x])
+                    for x in update_columns]))
+            qty += session.execute(statement).rowcount
+        return qty
+    # Other DBs (sqlite for the unit tests): update, else insert, row by row.
+    for row in rows:
+        if any(row[x] is None for x in keys):  # Like ON CONFLICT: NULL never matches.
+            session.execute(table.insert().values(row))
+            qty += 1
+            continue
+        changed = session.execute(table.update()
+            .where(and_(*[table.c[x] == row[x] for x in keys]))
+            .where(or_(*[table.c[x].is_distinct_from(row[x]) for x in update_columns]))
+            .values(dict((x, row[x]) for x in update_columns))
+            ).rowcount
+        if not changed and session.execute(table.select()
+                .where(and_(*[table.c[x] == row[x] for x in keys]))).first() is None:
+            session.execute(table.insert().values(row))
+            changed = 1
+        qty += changed
+    return qty
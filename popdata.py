@@ -24,6 +24,7 @@ from database_setup import Projects
 from database_setup import ProjectPlans
 from database_setup import ProjectHumanUsages
 from database_setup import ProjectElementUsages
+from database_setup import CONFLICT_USAGES
 #from database_setup import EmployeeDefaultHours
 
 def delete_empty_rows(df, column_list):
@@ -216,7 +217,7 @@ def import_data(DBsession, table, folder=os.path.abspath('source_data')):
         data = delete_empty_rows(data, 'name')
         data = replace_nan_with_none(data)
         session.add_all(
-            [table(element_usage=x) for x in data['name']]
+            [table(element_usage=x, conflict=(x in CONFLICT_USAGES)) for x in data['name']]
             )
     elif table is Employees:
         data = delete_empty_rows(data, ['name', 'registration_nr'])